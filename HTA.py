@@ -6,6 +6,8 @@ import queue
 import datetime
 import serial.tools.list_ports
 import sys
+import hts_adc
+import hts_engine
 
 __author__ = "Justin Fu"
 __copyright__ = "Copyright 2018, The Helios Testing Script"
@@ -77,13 +79,15 @@ class SerialThread(threading.Thread):
                     self.reset_flag.clear()
 
 
-                # Read a line from serial port    
-                self.read_out = ser.readline().decode('latin1')
+                # Read a line from serial port and classify it,
+                # only a UID line matters before the UID is detected, only an ADC line after it
+                self.read_out = ser.readline()
+                kind, value = hts_engine.classify(self.read_out, not uid_detect, count < max_count)
                 
 		# If 1. the message contains the UID, 
                 #    2. UID is not detected before
-                if "UID:" in self.read_out and not uid_detect:
-                    self.send = "UID: " + self.read_out[self.read_out.find('[')+1: self.read_out.find(']')]
+                if kind == hts_engine.LINE_UID:
+                    self.send = "UID: " + value
                     # Put the message(UID) into the queue
                     # The message is like, "UID: E007A20000001234"
                     self.queue.put(self.send)
@@ -95,9 +99,8 @@ class SerialThread(threading.Thread):
 		# If 1. the message contains the ADC value, 
                 #    2. the number of sent message(ADC) is less than maximum message(ADC) 
                 #    3. UID is detect
-                elif "Block 04 Data:" in self.read_out and count < max_count and uid_detect:
-                    self.adc_start = self.read_out.find('[')+5
-                    self.send = "ADC: " + self.read_out[self.adc_start+2: self.adc_start+4] + self.read_out[self.adc_start: self.adc_start+2]
+                elif kind == hts_engine.LINE_WORD and value is not None:
+                    self.send = "ADC: {:04X}".format(value)
                     # Put the message(ADC value in hex) into the queue
                     # The message is like, "ADC: 0001"
                     self.queue.put(self.send)
@@ -367,7 +370,7 @@ class  Application(tk.Frame):
 
 
     def adc_calculate(self, adc):
-        voltage = round(adc*0.9/16383/2*1000, 2)
+        voltage = hts_adc.to_millivolt(adc)
         return voltage
     
 
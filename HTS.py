@@ -1,15 +1,26 @@
 import tkinter
 import serial
-import csv
 import threading
 import queue
-import datetime
+import asyncio
+import os
+import re
 import serial.tools.list_ports
+import sqlite3
 import sys
-import visa
-import os
 import time
-from ftplib import FTP
+import hts_adc
+import hts_capture
+import hts_config
+import hts_db
+import hts_dmm
+import hts_engine
+import hts_ftp
+import hts_log
+import hts_retest
+import hts_serial
+import hts_trace
+import hts_view
 
 __author__ = "Justin Fu"
 __copyright__ = "Copyright 2018, Helios Testing Script"
@@ -17,45 +28,369 @@ __version__ = "0.4.5"
 __email__ = "justin.fu@pchintl.com"
 
 
+# Time (ms) between two checks of the message queues by the UI
+WAKE_MS = 20
+
+
 class Application(tkinter.Frame):
     """
     The class for the whole application
     """
-    def __init__(self, master=None):
+    def __init__(self, master=None, ports=None):
         """
-        Initilization function when the object is created
+        Initilization function when the object is created,
+        the MSP430 readers are detected when ports is not given
         """
         super().__init__(master)
         self.pack(fill="both", expand=True)
+        # Read station_setup and path_setup and find out the serial ports of the MSP430 readers
+        self.config = hts_config.StationConfig()
+        if ports is None:
+            ports = find_ports(self.config.options)
+        self.ports = ports
         self.create_widgets()
 
         master.protocol("WM_DELETE_WINDOW", self.close)
+        # F12 writes the recent output of every reader to a capture file
+        master.bind("<F12>", self.dump_serial)
 
         # Create a queue for serial to calculate
         self.serial_queue = queue.Queue()
-        # Create a queue for sending DMM value
-        self.DMM_queue = queue.Queue(maxsize=1)
+        # Set when a message is put in a queue, the UI checks it every WAKE_MS
+        self.wake_pending = threading.Event()
+        self.after(WAKE_MS, self.poll_messages)
         # Create an event for stopping the thread
         self.shutdown_event = threading.Event()
-        # Create a queue for sending station number
-        # TODO: station selection is not used any more, remove this queue
-        self.station_queue = queue.Queue(maxsize=1)
-        
-        self.serial_thread = SerialThread(self.serial_queue, self.DMM_queue, self.station_queue, self.shutdown_event)
-        self.serial_thread.start()
-        
+        # The Rigol DMM is measured in the background, the readings come back in this queue
+        self.dmm_results = queue.Queue()
+        # "dmm_mode read" sets up the DMM once and only triggers the readings
+        self.dmm = hts_dmm.DmmService(self.config.text("dmm_backend", ""), self.config.get("dmm_resource"),
+                                      mode=self.config.get("dmm_mode", "measure"),
+                                      voltage_range=self.config.get("dmm_range", "AUTO"),
+                                      nplc=self.config.get("dmm_nplc"))
+        self.dmm.start()
+        # "dmm_sample T" measures the DMM every T seconds instead of once for every part
+        self.dmm_sampler = None
+        if self.config.get("dmm_sample"):
+            self.dmm_sampler = hts_dmm.DmmSampler(self.dmm, [panel.dmm_readings for panel in self.panels.values()],
+                                                  float(self.config.get("dmm_sample")))
+            self.dmm_sampler.start()
+
+        self.serial_threads = []
+        # hts_db.ResultDatabase of start_serial, None when the results are not kept
+        self.database = None
+        self.start_serial()
         self.station_select()
 
+    def start_serial(self):
+        """
+        Create the log back end and a thread for every reader
+        """
+        # Create the log back end shared by every reader,
+        # "csv_flush rows N" or "csv_flush ms T" in station_setup buffers the csv rows
+        flush_rows, flush_ms = 1, 0
+        csv_flush = self.config.options.get("csv_flush")
+        if csv_flush and csv_flush[0] == "rows":
+            flush_rows = int(csv_flush[1])
+        elif csv_flush and csv_flush[0] == "ms":
+            flush_rows, flush_ms = 0, int(csv_flush[1])
+        # "ftp on" in station_setup uploads the csv files in the background
+        uploader = None
+        if self.config.get("ftp") == "on":
+            uploader = hts_ftp.FtpUploader(self.config.get("ftp_host", hts_ftp.HOST),
+                                           self.config.text("ftp_user", hts_ftp.USER),
+                                           self.config.text("ftp_password", hts_ftp.PASSWORD),
+                                           self.config.get("ftp_directory", hts_ftp.DIRECTORY),
+                                           int(self.config.get("ftp_port", 21)))
+            uploader.start()
+        # The results are also kept in the SQLite database, unless "database off"
+        self.database = None
+        if self.config.get("database", "on") == "on":
+            self.database = hts_db.ResultDatabase(self.config.text("database_path", hts_db.DEFAULT_PATH))
+            self.database.start()
+        self.logger = hts_log.ResultLogger(self.product_line, __version__, mes_dir=self.config.mes_path, flush_rows=flush_rows, flush_ms=flush_ms, uploader=uploader, database=self.database)
+        self.logger.create_directory()
+        # UIDs tested today, for flagging the retests
+        self.retest_index = hts_retest.RetestIndex()
+        self.retest_index.load(self.logger.log_dir, self.product_line)
+        # "trace on" in station_setup keeps every ADC word of the parts in a daily binary file
+        self.trace_log = None
+        if self.config.get("trace") == "on":
+            self.trace_log = hts_trace.TraceLog(self.logger.log_dir, self.product_line)
+
+        # Create a thread for every reader
+        for port_name in self.ports:
+            serial_thread = SerialThread(port_name, self.serial_queue, self.panels[port_name].dmm_readings, self.shutdown_event, self.logger, self.wake)
+            # "mode asyncio" in station_setup waits for the lines instead of polling,
+            # "mode chunk" reads the lines in chunks
+            serial_thread.mode = self.config.get("mode", "poll")
+            serial_thread.settings_queue.put(self.config.engine_settings)
+            # "calibration <port> <gain> <offset>" corrects the ADC of a reader,
+            # the lookup table of an uncalibrated reader gives the plain conversion faster
+            serial_thread.calibration = hts_adc.Calibration(*self.config.calibrations.get(port_name, (1.0, 0.0)))
+            serial_thread.retest_index = self.retest_index
+            serial_thread.trace_log = self.trace_log
+            # "serial_ring M" keeps the last M minutes (10) of raw reader output for the dumps
+            minutes = float(self.config.get("serial_ring", 10))
+            if minutes:
+                serial_thread.record_raw(int(minutes*60*hts_capture.BAUD/10))
+            # The DMM is measured when a sensor is detected at station 2,
+            # unless "dmm_auto off" or the DMM is sampled all the time
+            if self.config.get("dmm_auto", "on") == "on" and self.dmm_sampler is None:
+                panel = self.panels[port_name]
+                serial_thread.dmm_trigger = lambda panel=panel: self.dmm_measure(panel)
+            serial_thread.start()
+            self.serial_threads.append(serial_thread)
+
     def create_widgets(self):
         """ 
         Create the UI widgets
         """
+        # Frame for every reader: display UID and the test results
+        self.panels = {}
+        for port_name in self.ports:
+            if len(self.ports) > 1:
+                panel = ResultPanel(self, port_name, self.dmm_set, int(self.config.get("dmm_samples", 600)), self.show_history)
+            else:
+                panel = ResultPanel(self, None, self.dmm_set, int(self.config.get("dmm_samples", 600)), self.show_history)
+            panel.pack(fill='x')
+            self.panels[port_name] = panel
+
+        # Station radiobutton
+        # TODO: station selection is not used any more, station_setup file is used instead.
+        #       change the radiobutton to another kind of widget
+        station_show = self.config.station
+        product_line = self.config.product_line
+        self.station_number = tkinter.IntVar()
+        if station_show in ('1', '2', '3', '4'):
+            self.station_checkbox = tkinter.Radiobutton(self, text="Station_"+station_show, variable=self.station_number, value=int(station_show), command=self.station_select)
+            self.station_checkbox.pack(side="left", padx=10)
+        else:
+            print("Station setup error.")
+            time.sleep(1)
+            sys.exit()
+        
+        self.station_checkbox.select()
+        self.product_line = product_line
+        # Show the product line number
+        self.line_label = tkinter.Label(self, text="Product Line: "+product_line)
+        self.line_label.pack(side="left", padx=10)
+        # Show the version number
+        self.version_label = tkinter.Label(self, text="Version: "+__version__)
+        self.version_label.pack(side="right", padx=10)
+
+    # TODO: station selection is not used any more, remove this function
+    def station_select(self):
+        """
+        Station selection callback function
+        """
+        selection = self.station_number.get()
+        print(selection)
+        if selection in (1, 2, 3, 4):
+            for serial_thread in self.serial_threads:
+                put_latest(serial_thread.station_queue, selection)
+
+        for panel in self.panels.values():
+            panel.dmm_readings.clear()
+            panel.set_dmm('')
+    
+    def dmm_set(self, panel):
+        """
+        Get button callback function,
+        acquire voltage from Rigol DMM,
+        this function is only used in station 2
+        """
+        if self.station_number.get() == 2:
+            self.dmm_measure(panel)
+
+    def dmm_measure(self, panel):
+        """
+        Ask the DMM service for a reading of a reader,
+        called from the Get button and from the serial thread of the reader
+        """
+        # The engine waits for the requested reading before judging
+        panel.dmm_readings.request()
+        self.dmm.measure(lambda dmm_voltage, when: self.dmm_done(panel, dmm_voltage, when))
+
+    def dmm_done(self, panel, dmm_voltage, when):
+        """
+        Hand a DMM reading to the reader and the UI, called from the DMM service
+        """
+        panel.dmm_readings.add(when, dmm_voltage)
+        print(dmm_voltage)
+        self.dmm_results.put((panel, dmm_voltage))
+        self.wake()
+ 
+    def close(self):
+        """
+        Close the UI window and destroy the process
+        """
+        # the threads stop waking the UI up
+        self.shutdown_event.set()
+        for serial_thread in self.serial_threads:
+            serial_thread.stop()
+            serial_thread.join()
+        if self.dmm_sampler is not None:
+            self.dmm_sampler.close()
+            # Noise of the DMM over the last samples
+            for port_name, panel in self.panels.items():
+                print(port_name, panel.dmm_readings.stats())
+        self.dmm.close()
+        if self.trace_log is not None:
+            self.trace_log.close()
+        self.logger.close()
+        root.destroy()
+
+
+    def GUI_update(self):
+        """
+        Update the UI according the the message in queue
+        """
+        # check the setup files and the queues every 200ms, scheduled first
+        # so an error below does not stop the updates
+        root.after(200, self.GUI_update)
+        self.show_messages()
+        self.config_update()
+
+    def show_messages(self, event=None):
+        """
+        Take every message in queue and show the latest one of each reader,
+        a message holds the whole state of the reader so the older ones can be skipped
+        """
+        self.wake_pending.clear()
+        latest = {}
+        while True:
+            try:
+                port_name, message = self.serial_queue.get_nowait()
+            except queue.Empty:
+                break
+            latest[port_name] = message
+        for port_name, message in latest.items():
+            self.panels[port_name].show(message)
+        # Show the DMM readings
+        while True:
+            try:
+                panel, dmm_voltage = self.dmm_results.get_nowait()
+            except queue.Empty:
+                break
+            if dmm_voltage == hts_dmm.NO_READING:
+                # When the Rigol DMM is not connected, show "nodmm" on the UI
+                panel.set_dmm("nodmm")
+            else:
+                panel.set_dmm(dmm_voltage)
+
+    def poll_messages(self):
+        """
+        Show the queued messages when a thread woke the UI up, every WAKE_MS in the Tk thread
+        """
+        if self.wake_pending.is_set():
+            self.show_messages()
+        self.after(WAKE_MS, self.poll_messages)
+
+    def wake(self):
+        """
+        Wake the UI up after a message is put in queue, called from the serial
+        threads and the DMM service. Tk is not called here: a Tk call from another
+        thread waits for the Tk thread, which close() keeps busy joining the threads
+        """
+        if not self.shutdown_event.is_set():
+            self.wake_pending.set()
+
+
+    def show_history(self, panel):
+        """
+        Double-click callback of the UID box, show every result of the UID
+        in the result database in a window
+        """
+        uid = panel.uid_box.get().strip()
+        if not uid or self.database is None:
+            return
+        try:
+            results = self.database.lookup(uid)
+        except sqlite3.Error as error:
+            print("Result database error:", error)
+            return
+        window = tkinter.Toplevel(self)
+        window.title("History of " + uid)
+        text = tkinter.Text(window, height=min(max(len(results), 1), 20), width=90, font=("Counrier", 12))
+        text.pack(fill="both", expand=True)
+        if results:
+            text.insert("end", "\n".join(hts_db.format_result(result) for result in results))
+        else:
+            text.insert("end", uid + " not in the result database")
+        text.configure(state="disabled")
+
+
+    def dump_serial(self, event=None):
+        """
+        Write the recent raw output of every reader as capture files
+        """
+        for serial_thread in self.serial_threads:
+            if serial_thread.raw_ring is not None:
+                serial_thread.dump_raw("manual")
+
+
+    def config_update(self):
+        """
+        Take the changes of station_setup and path_setup, the product line,
+        the serial ports and the acquisition mode are only read at start
+        """
+        if not self.config.reload():
+            return
+        # Hand the new thresholds to the engines, replacing the ones not taken yet
+        for serial_thread in self.serial_threads:
+            put_latest(serial_thread.settings_queue, self.config.engine_settings)
+        # The MES files of the following results go to the new directory
+        mes_dir = self.logger.mes_dir
+        self.logger.mes_dir = self.config.mes_path
+        try:
+            self.logger.create_directory()
+        except OSError as error:
+            print("Cannot create the MES directory, keep", mes_dir, error)
+            self.logger.mes_dir = mes_dir
+        # Change the station
+        station_show = self.config.station
+        if station_show in ('1', '2', '3', '4') and int(station_show) != self.station_number.get():
+            self.station_checkbox.config(text="Station_"+station_show, value=int(station_show))
+            self.station_checkbox.select()
+            self.station_select()
+
+
+class ResultPanel(tkinter.Frame):
+    """
+    The UID and test result widgets of one reader
+    """
+    def __init__(self, master, port_name, dmm_command, dmm_size=64, history_command=None):
+        """
+        Initilization function when the object is created,
+        port_name is shown beside the UID when it is given,
+        history_command is called with the panel when the UID box is double-clicked
+        """
+        super().__init__(master)
+        # The last dmm_size DMM readings with their time, for the engine of the reader
+        self.dmm_readings = hts_dmm.DmmReadings(dmm_size)
+        # Last rendered value of every widget
+        self.view = hts_view.PanelView()
+        self.create_widgets(port_name, dmm_command)
+        if history_command is not None:
+            self.uid_box.bind("<Double-Button-1>", lambda event: history_command(self))
+
+    def create_widgets(self, port_name, dmm_command):
+        """
+        Create the UI widgets
+        """
         # Frame1: Display UID
         self.uid_frame = tkinter.Frame(self, relief="raised", borderwidth=1)
         self.uid_frame.pack(fill='x')
         # UID label for showing string "UID: " 
-        self.uid_label = tkinter.Label(self.uid_frame, text="UID: ", font=("Counrier", 25))
+        if port_name:
+            self.uid_label = tkinter.Label(self.uid_frame, text=port_name+" UID: ", font=("Counrier", 25))
+        else:
+            self.uid_label = tkinter.Label(self.uid_frame, text="UID: ", font=("Counrier", 25))
         self.uid_label.pack(side="left", padx=10, pady=10)
+        # Retest flag, shown when the UID was already tested today
+        self.retest_label = tkinter.Label(self.uid_frame, font=("Counrier", 14))
+        self.retest_label.pack(side="right", padx=10, pady=10)
         # UID box for showing UID
         self.uid_box = tkinter.Entry(self.uid_frame, font=("Counrier", 25), bg="light gray")
         self.uid_box.pack(fill="both", padx=10, pady=10, expand=True)
@@ -100,7 +435,7 @@ class Application(tkinter.Frame):
         self.dmm_box = tkinter.Text(self.test_cd_frame, height=1, width=6, font=("Counrier, 25"), bg="light gray")
         self.dmm_box.grid(row=1, column=0)
         # Get button for acquiring voltage from DMM
-        self.set_button = tkinter.Button(self.test_cd_frame, height=1, width=6, text="Get", font=("Counrier, 18"), command=self.dmm_set)
+        self.set_button = tkinter.Button(self.test_cd_frame, height=1, width=6, text="Get", font=("Counrier, 18"), command=lambda: dmm_command(self))
         self.set_button.grid(row=0, column=1, rowspan=2)
         # Charged value box
         self.charge_box = tkinter.Text(self.test_cd_frame, height=1, width=6, font=("Counrier, 25"), bg="light gray")
@@ -113,603 +448,285 @@ class Application(tkinter.Frame):
         self.result_cd_frame.grid(row=0, column=4, rowspan=2, sticky='w'+'e'+'n'+'s')
         self.result_cd_label = tkinter.Label(self.result_cd_frame, font=("Counrier", 25))
         self.result_cd_label.pack(fill="none", expand=True)
-
-        # Station radiobutton
-        # TODO: station selection is not used any more, station_setup file is used instead.
-        #       change the radiobutton to another kind of widget
-        station_show, product_line = self.station_setup()
-        self.station_number = tkinter.IntVar()
-        if station_show == '1':
-            self.station_checkbox = tkinter.Radiobutton(self, text="Station_1", variable=self.station_number, value=1, command=self.station_select)
-            self.station_checkbox.pack(side="left", padx=10)
-        elif station_show == '2':
-            self.station_checkbox = tkinter.Radiobutton(self, text="Station_2", variable=self.station_number, value=2, command=self.station_select)
-            self.station_checkbox.pack(side="left", padx=10)
-        elif station_show == '3':
-            self.station_checkbox = tkinter.Radiobutton(self, text="Station_3", variable=self.station_number, value=3, command=self.station_select)
-            self.station_checkbox.pack(side="left", padx=10)
-        elif station_show == '4':
-            self.station_checkbox = tkinter.Radiobutton(self, text="Station_4", variable=self.station_number, value=4, command=self.station_select)
-            self.station_checkbox.pack(side="left", padx=10)
-        else:
-            print("Station setup error.")
-            time.sleep(1)
-            sys.exit()
-        
-        self.station_checkbox.select()
-        # Show the product line number
-        self.line_label = tkinter.Label(self, text="Product Line: "+product_line)
-        self.line_label.pack(side="left", padx=10)
-        # Show the version number
-        self.version_label = tkinter.Label(self, text="Version: "+__version__)
-        self.version_label.pack(side="right", padx=10)
         # Acqure the original color, it is used when test finish
         self.origin_color = self.result_avg_frame.cget("background")
 
-    # TODO: station selection is not used any more, remove this function
-    def station_select(self):
-        """
-        Station selection callback function
-        """
-        selection = self.station_number.get()
-        print(selection)
-        if selection == 1:
-            self.station_queue.put(1)
-        elif selection == 2:
-            self.station_queue.put(2)
-        elif selection == 3:
-            self.station_queue.put(3)
-        elif selection == 4:
-            self.station_queue.put(4)
-        
-        if self.DMM_queue.full():
-            self.DMM_queue.get()
-            print("clear queue")
-            self.dmm_box.delete(0.0, "end")
-    
-    def dmm_set(self):
+    def show(self, message):
         """
-        Get button callback function,
-        acquire voltage from Rigol DMM,
-        this function is only used in station 2
+        Update the UI according to a message from the reader,
+        only the widgets whose value changed are touched
         """
-        if self.station_number.get() == 2:
-            # create a visa resource manager
-            rm = visa.ResourceManager()
-            # Find the Rigol DMM according the manager list
-            for inst in rm.list_resources():
-                try:
-                    rigol = rm.open_resource(inst)
-                    break
-                except:
-                    rigol = ""
-            if not rigol:
-                # When the Rigol DMM is not connected, show "nodmm" on the UI
-                print("no rigol")
-                dmm_voltage = -1
-                self.dmm_box.delete(0.0, "end")
-                self.dmm_box.insert(0.0, "nodmm")
-            else:
-                # Acquire the voltage from Rigol DMM
-                print(rigol.query("*IDN?"))
-                dmm_voltage = round(float(rigol.query(":measure:voltage:dc?"))*1000, 2)
-                self.dmm_box.delete(0.0, "end")
-                self.dmm_box.insert(0.0, dmm_voltage)
-
-            if self.DMM_queue.full():
-                self.DMM_queue.get()
-                print("clear queue")
-            self.DMM_queue.put(dmm_voltage)
-            print(dmm_voltage)
- 
-    def close(self):
+        changes = self.view.changes(message)
+        if not changes:
+            return
+        # update UID box
+        if hts_view.UID in changes:
+            self.uid_box.delete(0, "end")
+            self.uid_box.insert(0, changes[hts_view.UID])
+        # update average, DMM, charged and discharged voltage boxes
+        for name, box in ((hts_view.AVG, self.avg_box),
+                          (hts_view.DMM, self.dmm_box),
+                          (hts_view.CHARGE, self.charge_box),
+                          (hts_view.DISCHARGE, self.discharge_box)):
+            if name in changes:
+                box.delete(0.0, "end")
+                box.insert(0.0, changes[name])
+        # update the PASS/FAIL message boxes
+        for name, frame, label in ((hts_view.RESULT_AVG, self.result_avg_frame, self.result_avg_label),
+                                   (hts_view.RESULT_CD, self.result_cd_frame, self.result_cd_label)):
+            if name in changes:
+                text, colour = changes[name]
+                if colour is None:
+                    colour = self.origin_color
+                frame.configure(background=colour)
+                label.configure(text=text, background=colour)
+        # update the retest flag
+        if hts_view.RETEST in changes:
+            text, colour = changes[hts_view.RETEST]
+            self.retest_label.configure(text=text, background=colour or self.origin_color)
+
+    def set_dmm(self, text):
         """
-        Close the UI window and destroy the process
+        Show a DMM reading which does not come from the reader
         """
-        self.shutdown_event.set()
-        self.serial_thread.join()
-        root.destroy()
-
-
-    def GUI_update(self):
-        """
-        Update the UI according the the message in queue
-        """
-        # check the queue
-        if not self.serial_queue.empty():
-            message = self.serial_queue.get()
-            # update UID box
-            if message["UID"] == None:
-                self.uid_box.delete(0, "end")
-            else:
-                self.uid_box.delete(0, "end")
-                self.uid_box.insert(0, message["UID"])
-            # update average voltage box
-            if message["VOLT1"] == None:
-                self.avg_box.delete(0.0, "end")
-            else:
-                self.avg_box.insert(0.0, message["VOLT1"])
-            # update DMM voltage box
-            if message["DMM"] == None:
-                self.dmm_box.delete(0.0, "end")
-            else:
-                self.dmm_box.insert(0.0, message["DMM"])
-            # update charged voltage box
-            if message["VOLT2"] == None:
-                self.charge_box.delete(0.0, "end")
-            else:
-                self.charge_box.insert(0.0, message["VOLT2"])
-            # update discharged voltage box
-            if message["VOLT3"] == None:
-                self.discharge_box.delete(0.0, "end")
-            else:
-                self.discharge_box.insert(0.0, message["VOLT3"])
-            # update the PASS/FAIL message box
-            if message["RES1"] == None:
-                # reset
-                self.result_avg_frame.configure(background=self.origin_color)
-                self.result_avg_label.configure(text='', background=self.origin_color)
-            elif message["RES1"]%10:
-                # fail
-                self.result_avg_frame.configure(background="red")
-                self.result_avg_label.configure(text=message["RES1"], background="red")
-            elif message["RES1"]%10 == 0:
-                # pass
-                self.result_avg_frame.configure(background="green")
-                self.result_avg_label.configure(text="PASS", background="green")
-            # update the PASS/FAIL message box
-            if message["RES2"] == None:
-                # reset
-                self.result_cd_frame.configure(background=self.origin_color)
-                self.result_cd_label.configure(text='', background=self.origin_color)
-            elif message["RES2"]==99:
-                # redo
-                self.result_cd_frame.configure(background="yellow")
-                self.result_cd_label.configure(text="REDO", background="yellow")
-            elif message["RES2"]%10:
-                # fail
-                self.result_cd_frame.configure(background="red")
-                self.result_cd_label.configure(text=message["RES2"], background="red")
-            elif message["RES2"]%10 == 0:
-                # pass
-                self.result_cd_frame.configure(background="green")
-                self.result_cd_label.configure(text="PASS", background="green")
-
-        # update the UI every 200ms
-        root.after(200, self.GUI_update) 
-
-
-    def station_setup(self):
-        """
-        Read the station setup file
-        """
-        try:
-            setup_file = open("station_setup", 'r')
-        except FileNotFoundError:
-            print("No setup file")
-            return "error", 'D'
-        file_content = setup_file.readlines()
-        setup_file.close()
-        first_line = file_content[0].split()
-        if not first_line:
-            print("Empty")
-            return "error"
-        station = first_line[0]
-        print("Test:",station)
-
-        try:
-            second_line = file_content[1].split()
-        except IndexError:
-            second_line = '0'
-        if second_line[0] == '0':
-            product_line = '0'
-        elif second_line[0] == '1':
-            product_line = '1'
-        elif second_line[0] == '2':
-            product_line = '2'
-        elif second_line[0] == '3':
-            product_line = '3'
-        else:
-            product_line = 'D'
-        print("Line:", product_line)
-        return station, product_line
+        self.dmm_box.delete(0.0, "end")
+        self.dmm_box.insert(0.0, text)
+        self.view.set(hts_view.DMM, str(text))
 
 
 class SerialThread(threading.Thread):
     """
     Background thread class for reading the serial port and processing the reading
     """
-    def __init__(self, send_queue, receive_queue, station_queue, event):
+    def __init__(self, port_name, send_queue, receive_queue, event, logger, notify=None):
         threading.Thread.__init__(self)
+        # Name of the serial port of the reader
+        self.port_name = port_name
         # Create an event for stopping the thread
         self.shutdown_flag = event
         # Create a queue for sending UID and ADC value
         self.send_queue = send_queue
-        # Create a queue for receiving DMM value
+        # DMM readings of the reader (hts_dmm.DmmReadings)
         self.receive_queue = receive_queue
+        # Function called when a sensor is detected at station 2, to measure the DMM
+        self.dmm_trigger = None
+        # hts_adc.Calibration of the reader, None when it is not calibrated
+        self.calibration = None
+        # hts_retest.RetestIndex shared by the readers, None when the retests are not flagged
+        self.retest_index = None
+        # Retest flag of the sensor on the reader
+        self.retest = ''
+        # hts_trace.TraceLog of the ADC words of the parts, None when they are not kept
+        self.trace_log = None
         # Create a queue for setting station
-        self.station_queue = station_queue
-        # List all serial ports
-        ports = list(serial.tools.list_ports.comports())
-        # Exit when no serial port exist
-        if not ports:
-            sys.exit()
-        # Check and find out the serial port for MSP430
-        for p in ports:
-            if "MSP430" in str(p):
-                port_name = p.device
-                break
-            else:
-                port_name = ""
-        if not port_name:
-            sys.exit()
+        self.station_queue = queue.Queue(maxsize=1)
+        # Create a queue for setting the thresholds of the engine
+        self.settings_queue = queue.Queue(maxsize=1)
+        # Log back end, shared with the other readers
+        self.logger = logger
+        # Function called after a message is put in send_queue
+        self.notify = notify
+        # Acquisition mode, "poll" or "asyncio"
+        self.mode = "poll"
+        self.loop = None
+        self.task = None
         # Setup serial port
-        self.ser = serial.Serial(port_name, 9600, timeout=0.1)
+        self.ser = serial.serial_for_url(port_name, 9600, timeout=0.1)
+        # hts_serial.RawRing of the bytes received, None when they are not kept
+        self.raw_ring = None
+        # directory of the dumps of raw_ring
+        self.dump_dir = logger.log_dir
 
 
-    def run(self):
+    def record_raw(self, size):
+        """
+        Keep the last size bytes received from the reader, with their time
         """
-        Function for reading and processing the data from serial port
+        self.raw_ring = hts_serial.RawRing(size)
+        self.ser = hts_serial.RecordingPort(self.ser, self.raw_ring)
+
+
+    def dump_raw(self, reason):
         """
-        # variable for counting the time when the sensor left the board
-        sensor_out_count = 0
-        # maximum time of the sensor left the board
-        sensor_out_max = 5
-        # variable for storing the UID from the first iteration of the sensor reading
-        head = ""
-        # variable for counting the number iteration when the senosr stay on the board
-        body_count = 0
-        # maximum iteration of the sensor stay on the board
-        body_max= 30
-        tail = "END"
+        Write the bytes kept from the reader as a capture file, return its name
+        """
+        file_name = os.path.join(self.dump_dir, "Serial_{}_{}_{}.cap".format(
+            re.sub(r"\W", "_", self.port_name), time.strftime("%Y%m%d%H%M%S"), reason))
+        try:
+            count = self.raw_ring.dump(file_name)
+        except OSError as error:
+            print("serial dump error:", error)
+            return None
+        print("serial dump:", file_name, count, "records")
+        return file_name
+
 
+    def run(self):
+        """
+        Function for reading the serial port and handing the reading to the engine
+        """
         # default test station is #1
-        test = 1
-        
-        # message for UI update
-        message = {"UID": None, 
-                "VOLT1": None, 
-                "RES1": None, 
-                "DMM": None, 
-                "VOLT2": None, 
-                "VOLT3": None, 
-                "RES2": None}
-        
-        # Create directory for log storage
-        self.create_directory()
-        self.line = self.line_setup()
+        self.engine = hts_engine.StationEngine(1, self.receive_queue)
+        if self.calibration is not None:
+            self.engine.convert = self.calibration.to_millivolt
+        self.engine.capture = self.trace_log is not None
 
+        try:
+            if self.mode == "asyncio":
+                self.run_async()
+            elif self.mode == "chunk":
+                self.run_chunked()
+            else:
+                self.run_poll()
+        except Exception:
+            # Keep what the reader sent before the error
+            if self.raw_ring is not None:
+                self.dump_raw("error")
+            raise
+
+
+    def run_poll(self):
+        """
+        Function for polling the serial port line by line and handing the lines to the engine
+        """
         while True:
-            
+
             # Check the shutdown event
             if self.shutdown_flag.is_set():
                 return
-            # Read the station selection queue 
+            # Read the station selection queue
             if self.station_queue.full():
                 print("get message from station queue")
-                test = self.station_queue.get()
-
-            # Read a line from serial port
-            read_out = self.ser.readline().decode("latin1")
-            # The processing will reset when the sensor is out for a while
-            if not read_out and sensor_out_count < sensor_out_max and head:
-                # Count the time of sensor out
-                sensor_out_count += 1
-            elif not read_out and sensor_out_count == sensor_out_max and head:
-                # When the time of sensor out reach to maximum, send a empty message to reset UI
-                head = ""
-                sensor_out_count = 0
-                message = {"UID": None, 
-                        "VOLT1": None, 
-                        "RES1": None, 
-                        "DMM": None, 
-                        "VOLT2": None, 
-                        "VOLT3": None, 
-                        "RES2": None}
-                print(message)
-                self.send_queue.put(message)
-                # clear the dmm_queue
-                if self.receive_queue.full():
-                    self.receive_queue.get()
-           
-            # Acquire the first iteration UID and the following ADC data
-            if "UID:" in read_out and not head:
-                # Get the first iteration UID and assign it to head
-                head = read_out[read_out.find('[')+1: read_out.find(']')]
-                # Reset body message counting 
-                body_count = 0
-                # Store the head into the message
-                message["UID"] = head
-                # Update the UI to show the UID
-                self.send_queue.put(message)
-                #print(message)
-            
-            # Acquire the ADC value
-            elif "Block 04 Data:" in read_out and head and body_count < body_max:
-                #Get the ADC value and assign it to body
-                position = read_out.find('[') + 5
-                body = read_out[position+2: position+4] + read_out[position: position+2]
-                print(body)
-                try:
-                    # convert the ADC value to a voltage
-                    voltage = round((int(body, 16))*0.9/16383/2*1000, 2)
-                except ValueError:
-                    sensor_out_count = 0
-                    continue
-                # Necessary to reset the sensor_out_cout because 
-                # there is an empty reading after each iteration
-                sensor_out_count = 0
-                
-                # When station #1 and staion #3
-                if test == 1 or test == 3:
-                    if body_count == 0:
-                        # When iteration counting is zero, that means there is a new sensor on board
-                        # Clean the previous data
-                        voltage_sum = 0
-                        voltage_avg = 0
-                    elif body_count >= 10 and body_count <20:
-                        # Do nothing for the first 10 sets of data
-                        # Sum up the following 10 sets of data
-                        voltage_sum += voltage
-                    elif body_count == 21:
-                        # Set the iteration counting to max, 
-                        # when it reach to the 21st set of ADC value.
-                        # It will stop recording the block 04 data
-                        # At this time, count the average value
-                        body_count = body_max
-                        voltage_avg = voltage_sum/10
-                        # IMPORTANT: Do the judgement
-                        if voltage_avg > 5:
-                            # Error code
-                            res = test * 10 + 1
-                        else:
-                            # Error code
-                            res = test * 10
-                        # write the result to the message
-                        message["VOLT1"] = voltage_avg
-                        message["RES1"] = res
-                        print(message)
-                        # write the result to the log file
-                        self.record_result(test, message)
-                        # send the message to queue
-                        self.send_queue.put(message)
-
-                # When station #2 and station #4
-                elif test == 2 or test == 4:
-                    if body_count == 0:
-                        # When interation counting is zero, it means the UID is detect
-                        # At the same time, it will come with the first set of ADC value
-                        # the first set of ADC value is the charged value
-                        voltage2 = voltage
-                    elif body_count == 1:
-                        # Set the iteration counting to max, 
-                        # when it reach to the 2nd set of ADC value.
-                        # It will stop recording the block 04 data.
-                        # the second set of ADC value is the discharged value
-                        body_count = body_max
-                        voltage3 = voltage
-                        # write the result to the message
-                        message["VOLT2"] = voltage2
-                        message["VOLT3"] = voltage3
-                        # if it is station #2, check if any DMM input value exist
-                        if self.receive_queue.empty() and test == 2:
-                            message["RES2"] = 99
-                            print("empty queue")
-                        # if DMM input value exist
-                        elif test == 2:
-                            dmm_voltage = self.receive_queue.get()
-                            message["DMM"] = dmm_voltage
-                            # check if the DMM input value is invalid
-                            # IMPORTANT: Do the judgement
-                            if dmm_voltage == -1:
-                                message["DMM"] = None
-                                # Error code
-                                message["RES2"] = 99
-                                print("empty box")
-                            # When charged voltage out of 18V +/- 5V
-                            elif abs(voltage2-18) > 5:
-                                # Error code
-                                message["RES2"] = 21
-                            # When discharged voltage out of 0 +/- 5V
-                            elif voltage3 > 5:
-                                # Error code
-                                message["RES2"] = 22
-                            # When DMM voltage out of 18V +/- 5V
-                            elif abs(dmm_voltage-18) > 5:
-                                # Error code
-                                message["RES2"] = 23
-                            # When the different between charged voltage and DMM voltage
-                            # greater than 3.5V
-                            elif abs(voltage2-dmm_voltage) > 3.5:
-                                # Error code
-                                message["RES2"] = 24
-                            else:
-                                message["RES2"] = 20
-                        # if it is station #4
-                        elif test == 4:
-                            # When charged voltage out of 15V +/- 5V
-                            if abs(voltage2-15) > 5:
-                                # Error code
-                                message["RES2"] = 41
-                            # When discharged voltage out of 0 +/- 5V
-                            elif voltage3 > 5:
-                                # Error code
-                                message["RES2"] = 42
-                            else:
-                                message["RES2"] = 40
-                        
-                        print(message)
-
-                        # write the result to the log file
-                        self.record_result(test, message)
-                        # send the message to queue
-                        self.send_queue.put(message)
-                
-                # Finish one iteration processing
-                body_count += 1
-
-            # Do nothing when the iterating count reach to max
-            elif "Block 04 Data:" in read_out and head and body_count >= body_max:
-                sensor_out_count = 0
-
-
-    def create_directory(self):
-        """
-        Create a log directory
-        """
-        dirlog = "C:\PCH\HeliosLog"
-        if not os.path.exists(dirlog):
-            os.makedirs(dirlog)
-        dirmes = self.mes_path_acquire()
-        if not os.path.exists(dirmes):
-            os.makedirs(dirmes)
-
-
-    def record_result(self, test, message):
-        """
-        Record the log for normal analysis
-        """
-        # When station #2 and station #4
-        if test == 1 or test == 3:
-            file_name = "C:\PCH\HeliosLog\Test"+str(test)+"_Line"+self.line+'_'+str(datetime.date.today())+".csv"
-            with open(file_name, 'a', newline='') as testfile:
-                fieldnames = ["time", "uid", "volt1", "result"]
-                writer = csv.DictWriter(testfile, fieldnames=fieldnames)
-                writer.writerow({
-                    fieldnames[0]: str(datetime.datetime.now()), 
-                    fieldnames[1]: message["UID"], 
-                    fieldnames[2]: message["VOLT1"],
-                    fieldnames[3]: message["RES1"]})
-            
-            #self.ftp_update(file_name)
-            self.mes_record(test, message)
-
-        # When station #2 and station #4
-        elif test == 2 or test == 4:
-            file_name = "C:\PCH\HeliosLog\Test"+str(test)+"_Line"+self.line+'_'+str(datetime.date.today())+".csv"
-            with open(file_name, 'a', newline='') as testfile:
-                fieldnames = ["time", "uid", "dmm", "volt2", "volt3", "result"]
-                writer = csv.DictWriter(testfile, fieldnames=fieldnames)
-                writer.writerow({
-                    fieldnames[0]: str(datetime.datetime.now()),
-                    fieldnames[1]: message["UID"],
-                    fieldnames[2]: message["DMM"],
-                    fieldnames[3]: message["VOLT2"],
-                    fieldnames[4]: message["VOLT3"],
-                    fieldnames[5]: message["RES2"]})
-
-            #self.ftp_update(file_name)
-            self.mes_record(test, message)
-   
-
-    def mes_path_acquire(self):
-        """
-        Read the path_setup file for SUGA MES
-        """
-        try:
-            path_file = open("path_setup", 'r')
-        except FileNotFoundError:
-            print("No path file, use C:\PCH\MES")
-            return "C:\\PCH\\MES\\"
-        path = path_file.readline()
-        path_file.close()
-        if not path:
-            return "C:\\PCH\\MES\\"
-        path = path.strip()
-        if path[-1] != '\\':
-            path = path+'\\' 
-        return path
-
-
-    def mes_record(self, test, message):
-        """
-        Record the log file for SUGA MES
-        """
-        mes_path = self.mes_path_acquire()
-        mfile_name = mes_path+datetime.date.today().strftime("%Y%m%d")+datetime.datetime.now().strftime("%H%M%S")+'_'+message["UID"]+".txt"
-        with open(mfile_name, 'w') as mes_file:
-            mes_file.write("PanelBarcode:"+message["UID"]+"\n")
-            mes_file.write("TestProgram:HELIOS_TESTING_SCRIPT\n")
-            mes_file.write("TestProgramVer:"+__version__+"\n")
-            mes_file.write("Operator:TEST\n")
-            mes_file.write("Date:"+datetime.date.today().strftime("%m/%d/%Y")+"\n")
-            mes_file.write("Time:"+datetime.datetime.now().strftime("%H:%M:%S")+"\n"*3)
-            mes_file.write("TestName:TEST{}".format(test)+"\n")
-            mes_file.write("Date:"+datetime.date.today().strftime("%m/%d/%Y")+"\n")
-            mes_file.write("Time:"+datetime.datetime.now().strftime("%H:%M:%S")+"\n")
-            if message["RES1"] and message["RES1"]%10==0:
-                mes_file.write("Result:PASS\n")
-            elif message["RES2"] and message["RES2"]%10==0:
-                mes_file.write("Result:PASS\n")
-            else:
-                mes_file.write("Result:FAIL\n")
-            
-            new_message={}
-            for key,value in message.items():
-                if value is None:
-                    new_message[key] = ''
-                else:
-                    new_message[key] = "{}".format(value)+" "
-            mes_file.write("Value:"+new_message["VOLT1"]+new_message["RES1"]+new_message["DMM"]+new_message["VOLT2"]+new_message["VOLT3"]+new_message["RES2"]+"\n")
-            print("~#~", file=mes_file)
-            
-            
-    def ftp_update(self, file_name):
-        """
-        Update the log file in PCH FTP
-        """
-        try:
-            ftp = FTP("pchintl.net")
-        except:
-            print("FTP connection error")
-            return
+                self.engine.test = self.station_queue.get()
+            # Read the settings queue
+            if self.settings_queue.full():
+                self.engine.configure(self.settings_queue.get())
 
-        ftp.login("L'Oreal Helios", "PCH#2018")
+            # Read a line from serial port and process it
+            for event in self.engine.feed(self.ser.readline()):
+                self.handle(event)
 
-        file_path = os.path.basename(file_name)[0:5]
-        try:
-            ftp.cwd("HeliosLog/"+file_path)
-        except:
-            ftp.mkd("HeliosLog/"+file_path)
-            ftp.cwd("HeliosLog/"+file_path)
 
-        with open(file_name, 'rb') as fobj:
-            ftp.storlines("STOR " + os.path.basename(file_name), fobj)
+    def run_chunked(self):
+        """
+        Function for reading the serial port in chunks and handing the lines to the engine
+        """
+        reader = hts_serial.ChunkReader(self.ser)
+        while True:
 
-        ftp.quit()
+            # Check the shutdown event
+            if self.shutdown_flag.is_set():
+                return
+            # Read the station selection queue
+            if self.station_queue.full():
+                print("get message from station queue")
+                self.engine.test = self.station_queue.get()
+            # Read the settings queue
+            if self.settings_queue.full():
+                self.engine.configure(self.settings_queue.get())
+
+            # Read the lines held by the serial port, or a timeout, and process them,
+            # a read of part of a line is not a timeout
+            frames = reader.read_frames()
+            if frames is None:
+                frames = (b"",)
+            for frame in frames:
+                for event in self.engine.feed(frame):
+                    self.handle(event)
+
+
+    def run_async(self):
+        """
+        Function for waiting on the serial port in an asyncio event loop
+        """
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(hts_serial.acquire(self.ser, self.engine, self.handle, self.station_queue, self.settings_queue))
+        # The thread may be stopped before the loop runs
+        if self.shutdown_flag.is_set():
+            self.task.cancel()
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
 
 
-    def line_setup(self):
+    def stop(self):
         """
-        Set the product line number
+        Stop the thread, the caller should join it afterwards
         """
-        try:
-            setup_file = open("station_setup", 'r')
-        except FileNotFoundError:
-            print("No setup file")
-            return 'D'
-        file_content = setup_file.readlines()
-        try:
-            second_line = file_content[1].split()
-        except IndexError:
-            second_line = '0'
-        if second_line[0] == '0':
-            product_line = '0'
-        elif second_line[0] == '1':
-            product_line = '1'
-        elif second_line[0] == '2':
-            product_line = '2'
-        elif second_line[0] == '3':
-            product_line = '3'
-        else:
-            product_line = 'D'
-        print("Line:", product_line)
-        return product_line
+        self.shutdown_flag.set()
+        if self.task is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
 
 
-root = tkinter.Tk()
-app = Application(master=root)
-app.master.title("Helio Testing Script")
-app.master.maxsize(1000,4000)
-app.GUI_update()
-app.mainloop()
+    def handle(self, event):
+        """
+        Record the result and update the UI for an event from the engine
+        """
+        if self.retest_index is not None:
+            # the flag of a sensor is kept until it is taken away
+            if event.kind == hts_engine.UID:
+                self.retest = self.retest_index.text(self.engine.test, event.message["UID"])
+            elif event.kind == hts_engine.RESET:
+                self.retest = ''
+            event.message["RETEST"] = self.retest
+        if event.kind == hts_engine.RESULT:
+            print(event.message)
+            # write the result to the log file
+            self.logger.record_result(self.engine.test, event.message)
+            if self.retest_index is not None:
+                self.retest_index.add(self.engine.test, event.message["UID"],
+                                      hts_retest.result_code(self.engine.test, event.message))
+        elif event.kind == hts_engine.RESET:
+            print(event.message)
+            # the ADC words of the part which was taken away
+            if self.engine.trace is not None:
+                self.trace_log.record(self.engine.trace)
+                self.engine.trace = None
+        elif event.kind == hts_engine.UID and self.engine.test == 2 and self.dmm_trigger is not None:
+            self.dmm_trigger()
+        # send the message to queue
+        self.send_queue.put((self.port_name, event.message))
+        if self.notify is not None:
+            self.notify()
+
+
+def find_ports(options):
+    """
+    Find out the serial ports of the MSP430 readers,
+    the "ports" setting in station_setup is used instead when it is given
+    """
+    port_names = options.get("ports")
+    if port_names:
+        return port_names
+    # List all serial ports
+    ports = list(serial.tools.list_ports.comports())
+    # Check and find out the serial ports for MSP430
+    port_names = [p.device for p in ports if "MSP430" in str(p)]
+    # Exit when no serial port for MSP430 exist
+    if not port_names:
+        sys.exit()
+    return port_names
+
+
+def put_latest(item_queue, item):
+    """
+    Put an item in a queue of size 1 without waiting, replacing the item not taken yet
+    """
+    try:
+        item_queue.get_nowait()
+    except queue.Empty:
+        pass
+    item_queue.put_nowait(item)
+
+
+if __name__ == "__main__":
+    root = tkinter.Tk()
+    app = Application(master=root)
+    app.master.title("Helio Testing Script")
+    app.master.maxsize(1000,4000)
+    app.GUI_update()
+    app.mainloop()
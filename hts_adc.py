@@ -0,0 +1,130 @@
+"""
+ADC word to voltage conversion for the Helios Testing Script
+
+The MSP430 reader sends the 14-bit ADC word of the sensor, the voltage in mV is
+round(word*0.9/16383/2*1000, 2). The scalar conversion is the one used live by
+hts_engine. The window functions convert and average whole arrays of words at
+once with NumPy when it is installed, for reprocessing recorded data, and give
+the same values as the engine: NumPy rounds every 16-bit word like round() and
+numpy.cumsum adds the window in the same order as the running sum.
+
+A reader whose ADC drifts is corrected with a Calibration: the voltage is
+multiplied by a gain and shifted by an offset before the rounding. The voltage
+of every 14-bit word is computed once into a lookup table, so a conversion is
+an index into the table; a word out of the 14 bits is still computed.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Reference voltage (V) and full scale word of the ADC
+REFERENCE = 0.9
+FULL_SCALE = 16383
+# Number of words of the 14-bit ADC, the size of a lookup table
+TABLE_SIZE = 16384
+
+
+def to_millivolt(word):
+    """
+    Convert the ADC word to a voltage in mV
+    """
+    return round(word*REFERENCE/FULL_SCALE/2*1000, 2)
+
+
+class Calibration(object):
+    """
+    Gain and offset of the voltage of one reader, compiled into a lookup table
+    """
+    def __init__(self, gain=1.0, offset=0.0):
+        self.gain = gain
+        # offset in mV
+        self.offset = offset
+        self.table = [self.compute(word) for word in range(TABLE_SIZE)]
+        self.array = None
+        if numpy is not None:
+            self.array = numpy.array(self.table, dtype=numpy.float64)
+
+    def compute(self, word):
+        """
+        Compute the voltage in mV of an ADC word without the table
+        """
+        return round((word*REFERENCE/FULL_SCALE/2*1000)*self.gain + self.offset, 2)
+
+    def to_millivolt(self, word):
+        """
+        Convert the ADC word to a voltage in mV
+        """
+        if 0 <= word < TABLE_SIZE:
+            return self.table[word]
+        return self.compute(word)
+
+    def to_millivolts(self, words):
+        """
+        Convert a sequence of ADC words to voltages in mV,
+        a NumPy array when NumPy is installed, a list otherwise
+        """
+        if numpy is None:
+            return [self.to_millivolt(word) for word in words]
+        words = numpy.asarray(words)
+        inside = words < TABLE_SIZE
+        if inside.all():
+            return self.array[words]
+        # Compute the words out of the table
+        voltages = numpy.empty(words.shape, dtype=numpy.float64)
+        voltages[inside] = self.array[words[inside]]
+        outside = words[~inside].astype(numpy.float64)
+        voltages[~inside] = numpy.round((outside*REFERENCE/FULL_SCALE/2*1000)*self.gain + self.offset, 2)
+        return voltages
+
+
+def to_millivolts(words, calibration=None):
+    """
+    Convert a sequence of ADC words to voltages in mV, with the calibration of
+    the reader when given, a NumPy array when NumPy is installed, a list otherwise
+    """
+    if calibration is not None:
+        return calibration.to_millivolts(words)
+    if numpy is None:
+        return [to_millivolt(word) for word in words]
+    return numpy.round(numpy.asarray(words, dtype=numpy.float64)*REFERENCE/FULL_SCALE/2*1000, 2)
+
+
+def window_averages(words, start=10, stop=20, calibration=None):
+    """
+    Average voltage (mV) of the ADC words start to stop-1 of every part,
+    words holds one row of ADC words per part, as station #1 and station #3 judge it
+    """
+    count = stop - start
+    if numpy is None:
+        averages = []
+        for row in words:
+            voltage_sum = 0
+            for voltage in to_millivolts(row[start:stop], calibration):
+                voltage_sum += voltage
+            averages.append(voltage_sum/count)
+        return averages
+    voltages = to_millivolts(numpy.asarray(words)[:, start:stop], calibration)
+    # cumsum adds from left to right like the running sum, sum() does not
+    return numpy.cumsum(voltages, axis=1)[:, -1]/count
+
+
+def window_stats(voltages):
+    """
+    Mean, population standard deviation, minimum and maximum of every row of voltages
+    """
+    if numpy is None:
+        stats = []
+        for row in voltages:
+            mean = sum(row)/len(row)
+            stdev = (sum((voltage - mean)**2 for voltage in row)/len(row))**0.5
+            stats.append((mean, stdev, min(row), max(row)))
+        return stats
+    voltages = numpy.asarray(voltages, dtype=numpy.float64)
+    return numpy.stack([voltages.mean(axis=1), voltages.std(axis=1),
+                        voltages.min(axis=1), voltages.max(axis=1)], axis=1)
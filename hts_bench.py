@@ -0,0 +1,885 @@
+"""
+Benchmarks for the Helios Testing Script
+
+Replay recorded MSP430 reader streams through the acquisition engine without
+a reader attached:
+
+    python hts_bench.py replay captures/station1.cap captures/station2.cap
+    python hts_bench.py replay --realtime --station 2 --dmm 18.2 capture.cap
+    python hts_bench.py replay --log /tmp/helioslog captures/station1.cap
+    python hts_bench.py replay --repeat 20 --trace /tmp/helioslog captures/station1.cap
+    python hts_bench.py classify captures/station1.cap
+    python hts_bench.py serial captures/station1.cap
+    python hts_bench.py gui --messages 5000
+    python hts_bench.py render --parts 10000
+    python hts_bench.py generate captures
+    python hts_bench.py ftp --parts 500 --interval 0.01
+    python hts_bench.py dmm --clicks 200
+    python hts_bench.py dmm --sample 0.01 --seconds 5
+    python hts_bench.py adc --samples 3000000
+    python hts_bench.py stats --days 365 --lines 4
+    python hts_bench.py db --rows 2000000
+    python hts_bench.py parquet --directory helioslog
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import hts_adc
+import hts_capture
+import hts_db
+import hts_dmm
+import hts_engine
+import hts_ftp
+import hts_log
+import hts_parquet
+import hts_serial
+import hts_stats
+import hts_trace
+import hts_view
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+class FixedDMM(object):
+    """
+    Stand-in for the DMM readings which always hold the same reading
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def nearest(self, when, since=None):
+        return self.value
+
+    def waiting(self):
+        return False
+
+
+def replay(records, station, dmm=18.0, logger=None, realtime=False, trace_log=None):
+    """
+    Feed the capture records to a station engine and measure it,
+    in realtime mode the records are fed at their capture time
+    """
+    engine = hts_engine.StationEngine(station, FixedDMM(dmm))
+    engine.capture = trace_log is not None
+    lines = 0
+    parts = 0
+    # latency from the first UID line to the verdict, measured and in capture time
+    latency = []
+    capture_latency = []
+    uid_clock = uid_time = 0
+    first = records[0][0] if records else 0
+    start = time.perf_counter()
+    for now, line in records:
+        if realtime:
+            delay = start + now - first - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if line:
+            lines += 1
+        for event in engine.feed(line):
+            if event.kind == hts_engine.UID:
+                uid_clock = time.perf_counter()
+                uid_time = now
+            elif event.kind == hts_engine.RESULT:
+                if logger is not None:
+                    logger.record_result(station, event.message)
+                latency.append(time.perf_counter() - uid_clock)
+                capture_latency.append(now - uid_time)
+                parts += 1
+            elif event.kind == hts_engine.RESET and engine.trace is not None:
+                trace_log.record(engine.trace)
+                engine.trace = None
+    elapsed = time.perf_counter() - start
+    return {"station": station,
+            "records": len(records),
+            "lines": lines,
+            "parts": parts,
+            "elapsed": elapsed,
+            "latency": latency,
+            "capture_latency": capture_latency}
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of values
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered)-1, int(fraction*len(ordered)))]
+
+
+def report(name, stats):
+    """
+    Print the result of one replay
+    """
+    elapsed = stats["elapsed"] or float("nan")
+    print("{} (station {})".format(name, stats["station"]))
+    print("  records {:>9}   lines {:>9}   parts {:>7}   elapsed {:.3f} s".format(
+        stats["records"], stats["lines"], stats["parts"], stats["elapsed"]))
+    print("  lines/s {:>12.0f}   parts/s {:>12.1f}".format(
+        stats["lines"]/elapsed, stats["parts"]/elapsed))
+    for label, values in (("uid->verdict", stats["latency"]),
+                          ("uid->verdict (capture time)", stats["capture_latency"])):
+        if values:
+            print("  {:<28} median {:.6f} s   p95 {:.6f} s   max {:.6f} s".format(
+                label, statistics.median(values), percentile(values, 0.95), max(values)))
+
+
+def station_of(path, default):
+    """
+    Station number from a capture file name like "station2.cap"
+    """
+    match = re.search(r"station(\d)", os.path.basename(path))
+    if match:
+        return int(match.group(1))
+    return default
+
+
+def main_replay(args):
+    logger = None
+    if args.log:
+        logger = hts_log.ResultLogger(args.line, "bench", log_dir=args.log, mes_dir=os.path.join(args.log, "MES"))
+        logger.create_directory()
+    trace_log = None
+    if args.trace:
+        if not os.path.exists(args.trace):
+            os.makedirs(args.trace)
+        trace_log = hts_trace.TraceLog(args.trace, args.line)
+    for path in args.capture:
+        records = hts_capture.read_capture(path)
+        station = args.station or station_of(path, 1)
+        for _ in range(args.repeat - 1):
+            replay(records, station, args.dmm, logger, args.realtime, trace_log)
+        report(path, replay(records, station, args.dmm, logger, args.realtime, trace_log))
+    if logger is not None:
+        logger.close()
+    if trace_log is not None:
+        trace_log.close()
+
+
+def string_scan(read_out, head, body_count, body_max=30):
+    """
+    The per-line parsing of SerialThread.run before the byte classifier,
+    kept for comparison
+    """
+    read_out = read_out.decode("latin1")
+    if "UID:" in read_out and not head:
+        return read_out[read_out.find('[')+1: read_out.find(']')]
+    elif "Block 04 Data:" in read_out and head and body_count < body_max:
+        position = read_out.find('[') + 5
+        body = read_out[position+2: position+4] + read_out[position: position+2]
+        try:
+            return int(body, 16)
+        except ValueError:
+            return None
+    elif "Block 04 Data:" in read_out and head and body_count >= body_max:
+        return None
+
+
+def main_classify(args):
+    lines = []
+    for path in args.capture:
+        lines.extend(line for _, line in hts_capture.read_capture(path) if line)
+    if not lines:
+        print("no lines")
+        return
+    classify = hts_engine.classify
+    print("{} lines x {} rounds".format(len(lines), args.rounds))
+    # state of the engine: UID detected, number of ADC values processed
+    for state, head, body_count in (("waiting for UID", "", 0),
+                                    ("collecting ADC", "E007A20000001234", 0),
+                                    ("done", "E007A20000001234", 30)):
+        want_uid = not head
+        want_word = body_count < 30
+        # best of the rounds, the first ones warm up the caches
+        scan = classified = float("inf")
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            for line in lines:
+                string_scan(line, head, body_count)
+            scan = min(scan, time.perf_counter() - start)
+            start = time.perf_counter()
+            for line in lines:
+                classify(line, want_uid, want_word)
+            classified = min(classified, time.perf_counter() - start)
+        print("  {:<16} string scan {:7.0f} ns/line   classify {:7.0f} ns/line   x{:.2f}".format(
+            state, scan/len(lines)*1e9, classified/len(lines)*1e9, scan/classified))
+
+
+def read_pty(method, data, total):
+    """
+    Write data to a pty and read it back as total lines with readline() or the chunk reader,
+    return the time needed
+    """
+    import pty
+    import serial
+    master, slave = pty.openpty()
+    ser = serial.Serial(os.ttyname(slave), 9600, timeout=0.1)
+    writer = threading.Thread(target=os.write, args=(master, data))
+    writer.start()
+    start = time.perf_counter()
+    count = 0
+    if method == "readline":
+        while count < total:
+            if ser.readline():
+                count += 1
+    else:
+        reader = hts_serial.ChunkReader(ser)
+        while count < total:
+            count += len(reader.read_frames() or ())
+    elapsed = time.perf_counter() - start
+    writer.join()
+    ser.close()
+    os.close(master)
+    os.close(slave)
+    return elapsed
+
+
+def main_serial(args):
+    if os.name != "posix":
+        print("the serial benchmark needs a pty")
+        return
+    lines = []
+    for path in args.capture:
+        lines.extend(bytes(line) + b"\r\n" for _, line in hts_capture.read_capture(path) if line)
+    lines = lines * args.rounds
+    data = b"".join(lines)
+    print("{} lines, {} bytes through a pty".format(len(lines), len(data)))
+    for method in ("readline", "chunk"):
+        elapsed = read_pty(method, data, len(lines))
+        print("  {:<9} {:10.0f} lines/s   {:7.2f} us/line".format(method, len(lines)/elapsed, elapsed/len(lines)*1e6))
+
+
+def bench_messages(count):
+    """
+    Messages of a fast station 2 part: reset, UID and result, over and over
+    """
+    messages = []
+    for number in range(count):
+        message = hts_engine.empty_message()
+        part = number // 3
+        if number % 3:
+            message["UID"] = "E007A2{:010X}".format(part)
+        if number % 3 == 2:
+            message["DMM"] = 18.0
+            message["VOLT2"] = 17.99
+            message["VOLT3"] = 0.44
+            message["RES2"] = 20 if part % 4 else 22
+        messages.append(message)
+    messages[-1]["UID"] = "LAST"
+    return messages
+
+
+def main_gui(args):
+    import tkinter
+    import HTS
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError:
+        print("the GUI benchmark needs a display")
+        return
+    HTS.root = root
+
+    class BenchApplication(HTS.Application):
+        """
+        The application without serial threads and log files
+        """
+        def start_serial(self):
+            pass
+
+    app = BenchApplication(master=root, ports=["bench"])
+    panel = app.panels["bench"]
+    messages = bench_messages(args.messages)
+    times = {"renders": 0}
+    show = panel.show
+
+    def timed_show(message):
+        show(message)
+        times["renders"] += 1
+        if message["UID"] == "LAST":
+            root.update_idletasks()
+            times["shown"] = time.perf_counter()
+            root.quit()
+
+    def produce():
+        times["start"] = time.perf_counter()
+        for message in messages:
+            app.serial_queue.put(("bench", message))
+            app.wake()
+        times["queued"] = time.perf_counter()
+
+    panel.show = timed_show
+    producer = threading.Thread(target=produce)
+    root.after(500, producer.start)
+    app.GUI_update()
+    root.mainloop()
+    producer.join()
+    print("{} messages, {} renders".format(len(messages), times["renders"]))
+    print("  queued in {:.3f} s, last message shown {:.3f} s after it was queued, {:.3f} s in total".format(
+        times["queued"] - times["start"], times["shown"] - times["queued"], times["shown"] - times["start"]))
+    print("  one message per 200ms tick would need {:.0f} s".format(len(messages) * 0.2))
+    root.destroy()
+
+
+def legacy_show(panel, message):
+    """
+    The rendering of GUI_update before the view model, kept for comparison:
+    every box is touched and the voltage boxes are inserted without deleting
+    """
+    if message["UID"] == None:
+        panel.uid_box.delete(0, "end")
+    else:
+        panel.uid_box.delete(0, "end")
+        panel.uid_box.insert(0, message["UID"])
+    for key, box in (("VOLT1", panel.avg_box), ("DMM", panel.dmm_box),
+                     ("VOLT2", panel.charge_box), ("VOLT3", panel.discharge_box)):
+        if message[key] == None:
+            box.delete(0.0, "end")
+        else:
+            box.insert(0.0, message[key])
+    for text, colour, frame, label in (hts_view.result_avg(message["RES1"]) + (panel.result_avg_frame, panel.result_avg_label),
+                                       hts_view.result_cd(message["RES2"]) + (panel.result_cd_frame, panel.result_cd_label)):
+        colour = colour or panel.origin_color
+        frame.configure(background=colour)
+        label.configure(text=text, background=colour)
+
+
+def time_updates(show, messages, window):
+    """
+    Time the updates of the first and the last window of messages,
+    return the average time per update of both
+    """
+    first = last = 0.0
+    for number, message in enumerate(messages):
+        start = time.perf_counter()
+        show(message)
+        elapsed = time.perf_counter() - start
+        if number < window:
+            first += elapsed
+        elif number >= len(messages) - window:
+            last += elapsed
+    return first / window, last / window
+
+
+def main_render(args):
+    # Station 1 parts without reset in between: UID and result, over and over,
+    # so the boxes which are not cleared keep growing in the legacy rendering
+    messages = []
+    for part in range(args.parts):
+        message = hts_engine.empty_message()
+        message["UID"] = "E007A2{:010X}".format(part)
+        messages.append(dict(message))
+        message["VOLT1"] = 1.76 + part % 7
+        message["RES1"] = 11 if message["VOLT1"] > 5 else 10
+        messages.append(message)
+    window = min(1000, len(messages) // 2)
+    print("{} updates of {} parts, average of the first and the last {} updates".format(len(messages), args.parts, window))
+
+    view = hts_view.PanelView()
+    first, last = time_updates(view.changes, messages, window)
+    print("  {:<18} first {:8.2f} us   last {:8.2f} us".format("view model only", first*1e6, last*1e6))
+
+    import tkinter
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError:
+        print("  the Tk part of the benchmark needs a display")
+        return
+    import HTS
+    for name in ("legacy", "view model"):
+        panel = HTS.ResultPanel(root, None, None)
+        panel.pack()
+        if name == "legacy":
+            show = lambda message: legacy_show(panel, message)
+        else:
+            show = panel.show
+        first, last = time_updates(show, messages, window)
+        print("  {:<18} first {:8.2f} us   last {:8.2f} us   avg box {} characters".format(
+            name, first*1e6, last*1e6, len(panel.avg_box.get(0.0, "end"))))
+        panel.destroy()
+    root.destroy()
+
+
+def generate_part(rng, station, now):
+    """
+    Create the capture records of one sensor put on the reader and taken away
+    """
+    records = []
+    uid = "E007A2{:010X}".format(rng.getrandbits(40))
+    if station == 1 or station == 3:
+        # 22 readings are judged, a few more come before the sensor is taken away
+        level = rng.choice((60, 90, 120, 150, 400))
+        words = [max(0, int(rng.gauss(level, 8))) for _ in range(25)]
+    else:
+        charged = int(rng.gauss(655 if station == 2 else 546, 40))
+        words = [charged, int(rng.gauss(30, 20))] + [int(rng.gauss(30, 20)) for _ in range(3)]
+    for word in words:
+        word = min(max(word, 0), 0xFFFF)
+        for line in ("UID: [{}]".format(uid),
+                     "Block 04 Data: [0000{:02X}{:02X}]".format(word & 0xFF, word >> 8),
+                     ""):
+            now += hts_capture.line_time(line)
+            records.append((now, line))
+    # the sensor is taken away, the reader stays quiet for a while
+    for _ in range(rng.randint(8, 20)):
+        now += hts_capture.TIMEOUT
+        records.append((now, ""))
+    return records, now
+
+
+def main_generate(args):
+    rng = random.Random(args.seed)
+    if not os.path.exists(args.directory):
+        os.makedirs(args.directory)
+    for station in (1, 2, 3, 4):
+        records = []
+        now = 0.0
+        for _ in range(args.parts):
+            part, now = generate_part(rng, station, now)
+            records.extend(part)
+        path = os.path.join(args.directory, "station{}.cap".format(station))
+        hts_capture.write_capture(path, records)
+        print(path, len(records), "records")
+
+
+def serve_ftp(directory):
+    """
+    Start a local FTP server on directory with the login of the PCH server,
+    return the server and its port
+    """
+    import logging
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import FTPServer
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(hts_ftp.USER, hts_ftp.PASSWORD, directory, perm="elradfmw")
+    handler = type("BenchHandler", (FTPHandler,), {"authorizer": authorizer})
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+    server = FTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, kwargs={"timeout": 0.1}, daemon=True).start()
+    return server, server.address[1]
+
+
+def main_ftp(args):
+    import tempfile
+    try:
+        import pyftpdlib
+    except ImportError:
+        print("the FTP benchmark needs pyftpdlib")
+        return
+    with tempfile.TemporaryDirectory() as work:
+        remote = os.path.join(work, "remote")
+        os.makedirs(os.path.join(remote, hts_ftp.DIRECTORY))
+        server, port = serve_ftp(remote)
+        uploader = hts_ftp.FtpUploader("127.0.0.1", port=port, delay=args.delay)
+        uploader.start()
+        logger = hts_log.ResultLogger('D', "bench", log_dir=os.path.join(work, "log"),
+                                      mes_dir=os.path.join(work, "MES"), uploader=uploader)
+        logger.create_directory()
+        rng = random.Random(args.seed)
+        record_times = []
+        for number in range(args.parts):
+            message = hts_engine.empty_message()
+            message["UID"] = "E007A2{:010X}".format(rng.getrandbits(40))
+            message["VOLT1"] = round(rng.uniform(0, 6), 3)
+            message["RES1"] = 11 if message["VOLT1"] > 5 else 10
+            start = time.perf_counter()
+            logger.record_result(1, message)
+            record_times.append(time.perf_counter() - start)
+            time.sleep(args.interval)
+        start = time.perf_counter()
+        logger.close()
+        closing = time.perf_counter() - start
+        server.close_all()
+
+        local = logger.csv_logs[1].file_name
+        remote_file = os.path.join(remote, uploader.remote_directory(local), os.path.basename(local))
+        with open(local, 'rb') as fobj:
+            local_data = fobj.read()
+        with open(remote_file, 'rb') as fobj:
+            same = fobj.read() == local_data
+    print("{} parts, {} uploads, {} failures, {} bytes sent for a {} byte log, remote copy {}".format(
+        args.parts, uploader.uploads, uploader.failures, uploader.bytes_sent, len(local_data),
+        "matches" if same else "DIFFERS"))
+    print("  record_result  median {:.6f} s   max {:.6f} s   close {:.3f} s".format(
+        statistics.median(record_times), max(record_times), closing))
+
+
+def legacy_dmm(backend):
+    """
+    The Get button before the DMM service: a new resource manager,
+    the first resource which opens, *IDN? and the measurement
+    """
+    rm = hts_dmm.visa.ResourceManager(backend)
+    rigol = ""
+    for inst in rm.list_resources():
+        try:
+            rigol = rm.open_resource(inst)
+            break
+        except Exception:
+            rigol = ""
+    if not rigol:
+        return hts_dmm.NO_READING
+    rigol.query("*IDN?")
+    try:
+        dmm_voltage = hts_dmm.to_millivolt(rigol.query(":measure:voltage:dc?"))
+    except ValueError:
+        # the first resource is not always the DMM
+        dmm_voltage = hts_dmm.NO_READING
+    rigol.close()
+    rm.close()
+    return dmm_voltage
+
+
+def click_times(service, clicks):
+    """
+    Time from the request to the reading of a DMM service, one click after the other
+    """
+    times = []
+    done = threading.Event()
+    values = []
+
+    def callback(value, when):
+        values.append(value)
+        done.set()
+
+    for _ in range(clicks):
+        done.clear()
+        start = time.perf_counter()
+        service.measure(callback)
+        done.wait()
+        times.append(time.perf_counter() - start)
+    return times, values
+
+
+def sample_dmm(args):
+    """
+    Sample the DMM into a ring buffer and time the nearest reading lookups
+    """
+    service = hts_dmm.DmmService(args.backend, mode=args.mode, voltage_range=args.range, nplc=args.nplc)
+    service.start()
+    readings = hts_dmm.DmmReadings(args.size)
+    sampler = hts_dmm.DmmSampler(service, [readings], args.sample)
+    start = time.monotonic()
+    sampler.start()
+    time.sleep(args.seconds)
+    sampler.close()
+    service.close()
+    stats = readings.stats()
+    if stats is None:
+        print("no readings")
+        return
+    print("sampled every {} s for {} s, {} readings kept of {}".format(
+        args.sample, args.seconds, stats.count, args.size))
+    print("  DMM  mean {:.3f} mV   stdev {:.4f} mV   min {:.3f} mV   max {:.3f} mV".format(
+        stats.mean, stats.stdev, stats.minimum, stats.maximum))
+    rng = random.Random(1)
+    lookups = [start + rng.uniform(0, args.seconds) for _ in range(10000)]
+    begin = time.perf_counter()
+    for when in lookups:
+        readings.nearest(when)
+    elapsed = time.perf_counter() - begin
+    print("  nearest reading lookup {:.2f} us".format(elapsed/len(lookups)*1e6))
+
+
+def main_dmm(args):
+    try:
+        import pyvisa_sim
+    except ImportError:
+        if args.backend.endswith("@sim"):
+            print("the DMM benchmark needs pyvisa-sim")
+            return
+    if args.sample:
+        sample_dmm(args)
+        return
+    print("{} clicks on {}".format(args.clicks, args.backend or "the default VISA library"))
+    times = []
+    for _ in range(args.clicks):
+        start = time.perf_counter()
+        value = legacy_dmm(args.backend)
+        times.append(time.perf_counter() - start)
+    print("  {:<16} median {:.6f} s   p95 {:.6f} s   first {:.6f} s   reading {}".format(
+        "new session", statistics.median(times), percentile(times, 0.95), times[0], value))
+
+    for mode in ("measure", "read"):
+        service = hts_dmm.DmmService(args.backend, mode=mode, voltage_range=args.range, nplc=args.nplc)
+        service.start()
+        times, values = click_times(service, args.clicks)
+        service.close()
+        print("  {:<16} median {:.6f} s   p95 {:.6f} s   first {:.6f} s   reading {}".format(
+            "service, " + mode, statistics.median(times), percentile(times, 0.95), times[0], values[-1]))
+
+
+def main_adc(args):
+    rng = random.Random(args.seed)
+    parts = args.samples // 30
+    words = [[rng.randrange(16384) for _ in range(30)] for _ in range(parts)]
+    flat = [word for row in words for word in row]
+    print("{} ADC words, {} parts of 30 words, {}".format(
+        len(flat), parts, "NumPy " + hts_adc.numpy.__version__ if hts_adc.numpy else "without NumPy"))
+
+    start = time.perf_counter()
+    voltages = [hts_engine.adc_to_voltage(word) for word in flat]
+    per_sample = time.perf_counter() - start
+    # recorded words are read as an array, not as a list of ints
+    if hts_adc.numpy is not None:
+        flat = hts_adc.numpy.array(flat, dtype=hts_adc.numpy.uint16)
+    start = time.perf_counter()
+    array = hts_adc.to_millivolts(flat)
+    whole = time.perf_counter() - start
+    same = list(array) == voltages
+    print("  convert   per word {:8.3f} s   whole array {:8.3f} s   x{:.0f}   same values: {}".format(
+        per_sample, whole, per_sample/whole, same))
+
+    # The running sum of station #1 and station #3
+    start = time.perf_counter()
+    averages = []
+    for row in words:
+        voltage_sum = 0
+        for word in row[10:20]:
+            voltage_sum += hts_engine.adc_to_voltage(word)
+        averages.append(voltage_sum/10)
+    per_sample = time.perf_counter() - start
+    if hts_adc.numpy is not None:
+        words = hts_adc.numpy.array(words, dtype=hts_adc.numpy.uint16)
+    start = time.perf_counter()
+    window = hts_adc.window_averages(words)
+    whole = time.perf_counter() - start
+    same = list(window) == averages
+    print("  average   per word {:8.3f} s   whole array {:8.3f} s   x{:.0f}   same values: {}".format(
+        per_sample, whole, per_sample/whole, same))
+
+    # The live conversion of one word, arithmetic or a lookup table
+    calibration = hts_adc.Calibration()
+    sample = [int(word) for word in flat[:1000000]]
+    for name, convert in (("arithmetic", hts_engine.adc_to_voltage), ("lookup table", calibration.to_millivolt)):
+        start = time.perf_counter()
+        for word in sample:
+            convert(word)
+        elapsed = time.perf_counter() - start
+        print("  one word  {:<13} {:6.1f} ns".format(name, elapsed/len(sample)*1e9))
+
+
+def generate_log(rng, path, station, day, parts):
+    """
+    Write the HeliosLog csv file of one station and one day
+    """
+    now = datetime.datetime.combine(day, datetime.time(7))
+    rows = []
+    for _ in range(parts):
+        now += datetime.timedelta(seconds=rng.uniform(5, 15))
+        uid = "E007A2{:010X}".format(rng.getrandbits(40))
+        if station == 1 or station == 3:
+            code = station*10 if rng.random() < 0.95 else station*10 + 1
+            rows.append("{},{},{:.2f},{}\r\n".format(now, uid, rng.gauss(4.5 if code % 10 == 0 else 12, 1), code))
+        else:
+            dmm = rng.gauss(18 if station == 2 else 15, 1)
+            code = station*10 if rng.random() < 0.9 else rng.choice((21, 22, 23, 24, 99) if station == 2 else (41, 42))
+            rows.append("{},{},{},{:.2f},{:.2f},{}\r\n".format(
+                now, uid, -1 if code == 99 else round(dmm, 2), rng.gauss(dmm, 1), rng.gauss(1, 0.5), code))
+    with open(path, 'w', newline='') as log_file:
+        log_file.writelines(rows)
+
+
+def main_stats(args):
+    rng = random.Random(args.seed)
+    directory = args.directory
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    first = datetime.date(2018, 1, 1)
+    start = time.perf_counter()
+    files = 0
+    for number in range(args.days):
+        day = first + datetime.timedelta(days=number)
+        for line in "ABCDEFGH"[:args.lines]:
+            for station in (1, 2, 3, 4):
+                path = os.path.join(directory, "Test{}_Line{}_{}.csv".format(station, line, day))
+                if not os.path.exists(path):
+                    generate_log(rng, path, station, day, args.parts)
+                files += 1
+    print("{} log files of {} parts in {} ({:.1f} s to generate)".format(
+        files, args.parts, directory, time.perf_counter() - start))
+
+    for jobs in (1, args.jobs):
+        start = time.perf_counter()
+        groups, stations = hts_stats.summarize(hts_stats.find_logs([directory]), hts_stats.KEYS, jobs)
+        elapsed = time.perf_counter() - start
+        tests = sum(summary.tests for summary in stations.values())
+        print("  {:>3} processes {:7.2f} s   {:9.0f} rows/s   {} groups".format(
+            jobs or os.cpu_count(), elapsed, tests/elapsed, len(groups)))
+
+
+def main_db(args):
+    rng = random.Random(args.seed)
+    path = os.path.join(args.directory, "HeliosResults.db")
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+    database = hts_db.ResultDatabase(path)
+    database.start()
+    now = datetime.datetime(2018, 1, 1, 7)
+    uids = []
+    start = time.perf_counter()
+    for number in range(args.rows):
+        # a sensor goes through the four stations, some of them twice
+        if number % 4 == 0:
+            uids.append("E007A2{:010X}".format(rng.getrandbits(40)))
+        uid = uids[-1] if rng.random() < 0.98 else rng.choice(uids)
+        now += datetime.timedelta(seconds=2)
+        station = number % 4 + 1
+        message = hts_engine.empty_message()
+        message["UID"] = uid
+        if station == 1 or station == 3:
+            message["VOLT1"], message["RES1"] = round(rng.gauss(4.5, 1), 2), station*10
+        else:
+            message["DMM"], message["VOLT2"], message["VOLT3"], message["RES2"] = 18.0, 18.1, 1.0, station*10
+        database.record("ABCD"[number % 3], station, message, now)
+    queued = time.perf_counter() - start
+    database.close()
+    elapsed = time.perf_counter() - start
+    print("{} rows: {:.1f} us per record() call, {:.1f} s written in {} transactions".format(
+        database.rows, queued/args.rows*1e6, elapsed, database.transactions))
+
+    database = hts_db.ResultDatabase(path)
+    sample = [rng.choice(uids) for _ in range(args.lookups)]
+    times = []
+    for uid in sample:
+        start = time.perf_counter()
+        database.lookup(uid)
+        times.append(time.perf_counter() - start)
+    print("{} UID lookups: median {:.1f} us   p99 {:.1f} us   max {:.1f} us".format(
+        len(times), percentile(times, 0.5)*1e6, percentile(times, 0.99)*1e6, max(times)*1e6))
+    database.close()
+
+
+def main_parquet(args):
+    if hts_parquet.pyarrow is None:
+        print("the parquet benchmark needs pyarrow")
+        return
+    output = args.output or os.path.join(args.directory, "parquet")
+    start = time.perf_counter()
+    converted, skipped, rows = hts_parquet.export([args.directory], output)
+    print("{} files converted ({} rows), {} files up to date in {:.2f} s".format(
+        converted, rows, skipped, time.perf_counter() - start))
+
+    # The csv files of the quarter, read into typed rows like a spreadsheet would
+    start = time.perf_counter()
+    count = 0
+    for path in hts_stats.find_logs([args.directory], args.since, args.until):
+        with open(path, 'r', newline='') as log_file:
+            for row in csv.reader(log_file):
+                typed = [datetime.datetime.fromisoformat(row[0]), row[1]]
+                typed.extend(float(value) if value else None for value in row[2:-1])
+                typed.append(int(row[-1]))
+                count += 1
+    print("  csv      {:8.2f} s   {} rows".format(time.perf_counter() - start, count))
+    start = time.perf_counter()
+    table = hts_parquet.load(output, args.since, args.until)
+    print("  parquet  {:8.2f} s   {} rows".format(time.perf_counter() - start, table.num_rows))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Helios Testing Script benchmarks")
+    commands = parser.add_subparsers(dest="command")
+
+    replay_parser = commands.add_parser("replay", help="replay capture files through the engine")
+    replay_parser.add_argument("capture", nargs='+', help="capture files")
+    replay_parser.add_argument("--station", type=int, default=0, help="station number, default from the file name")
+    replay_parser.add_argument("--dmm", type=float, default=18.0, help="DMM reading for station 2 (mV)")
+    replay_parser.add_argument("--realtime", action="store_true", help="replay at the capture (wall-clock) speed")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="number of replays, the last one is reported")
+    replay_parser.add_argument("--log", help="record the results as HeliosLog/MES files in this directory")
+    replay_parser.add_argument("--trace", help="capture the ADC words in a trace file in this directory")
+    replay_parser.add_argument("--line", default='D', help="product line number used in the log file name")
+    replay_parser.set_defaults(func=main_replay)
+
+    classify_parser = commands.add_parser("classify", help="compare the line classifier with the string scan")
+    classify_parser.add_argument("capture", nargs='+', help="capture files")
+    classify_parser.add_argument("--rounds", type=int, default=50)
+    classify_parser.set_defaults(func=main_classify)
+
+    serial_parser = commands.add_parser("serial", help="compare readline() with the chunk reader on a pty")
+    serial_parser.add_argument("capture", nargs='+', help="capture files")
+    serial_parser.add_argument("--rounds", type=int, default=10)
+    serial_parser.set_defaults(func=main_serial)
+
+    gui_parser = commands.add_parser("gui", help="push messages to the UI and measure the time to display")
+    gui_parser.add_argument("--messages", type=int, default=5000)
+    gui_parser.set_defaults(func=main_gui)
+
+    render_parser = commands.add_parser("render", help="time the result panel updates over a shift")
+    render_parser.add_argument("--parts", type=int, default=10000)
+    render_parser.set_defaults(func=main_render)
+
+    generate_parser = commands.add_parser("generate", help="generate synthetic capture files")
+    generate_parser.add_argument("directory")
+    generate_parser.add_argument("--parts", type=int, default=20)
+    generate_parser.add_argument("--seed", type=int, default=2018)
+    generate_parser.set_defaults(func=main_generate)
+
+    ftp_parser = commands.add_parser("ftp", help="log parts with the FTP upload to a local pyftpdlib server")
+    ftp_parser.add_argument("--parts", type=int, default=500)
+    ftp_parser.add_argument("--interval", type=float, default=0.01, help="seconds between parts")
+    ftp_parser.add_argument("--delay", type=float, default=0.2, help="seconds the uploader waits for a burst")
+    ftp_parser.add_argument("--seed", type=int, default=1)
+    ftp_parser.set_defaults(func=main_ftp)
+
+    dmm_parser = commands.add_parser("dmm", help="time the DMM readings of the Get button")
+    dmm_parser.add_argument("--clicks", type=int, default=200)
+    dmm_parser.add_argument("--backend", default="rigol_sim.yaml@sim", help='VISA library, "" for the instrument')
+    dmm_parser.add_argument("--range", default="AUTO", help="DC voltage range of the read mode")
+    dmm_parser.add_argument("--nplc", default=None, help="integration time of the read mode")
+    dmm_parser.add_argument("--sample", type=float, default=0, help="sample the DMM at this interval (s) instead")
+    dmm_parser.add_argument("--seconds", type=float, default=5, help="time to sample the DMM")
+    dmm_parser.add_argument("--size", type=int, default=600, help="readings kept when sampling")
+    dmm_parser.add_argument("--mode", default="read", help="DMM service mode when sampling")
+    dmm_parser.set_defaults(func=main_dmm)
+
+    adc_parser = commands.add_parser("adc", help="compare the per word ADC conversion with the array conversion")
+    adc_parser.add_argument("--samples", type=int, default=3000000)
+    adc_parser.add_argument("--seed", type=int, default=1)
+    adc_parser.set_defaults(func=main_adc)
+
+    stats_parser = commands.add_parser("stats", help="summarize synthetic HeliosLog files with hts_stats")
+    stats_parser.add_argument("--directory", default="helioslog", help="where the log files are generated")
+    stats_parser.add_argument("--days", type=int, default=365)
+    stats_parser.add_argument("--lines", type=int, default=4, help="product lines, up to 8")
+    stats_parser.add_argument("--parts", type=int, default=300, help="parts per station and day")
+    stats_parser.add_argument("--jobs", type=int, default=None, help="worker processes, all the cores by default")
+    stats_parser.add_argument("--seed", type=int, default=1)
+    stats_parser.set_defaults(func=main_stats)
+
+    db_parser = commands.add_parser("db", help="fill the result database and time the UID lookups")
+    db_parser.add_argument("--directory", default=".", help="where the database is created")
+    db_parser.add_argument("--rows", type=int, default=2000000)
+    db_parser.add_argument("--lookups", type=int, default=10000)
+    db_parser.add_argument("--seed", type=int, default=1)
+    db_parser.set_defaults(func=main_db)
+
+    parquet_parser = commands.add_parser("parquet", help="export log files to Parquet and time loading a quarter")
+    parquet_parser.add_argument("--directory", default="helioslog", help="log files, like the ones of the stats benchmark")
+    parquet_parser.add_argument("--output", help="Parquet dataset, default parquet in the log directory")
+    parquet_parser.add_argument("--since", default="2018-01-01")
+    parquet_parser.add_argument("--until", default="2018-03-31")
+    parquet_parser.set_defaults(func=main_parquet)
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Plain text capture files of MSP430 reader output
+
+One record per line, "<seconds>\t<reader line>", where the reader line is
+stored without its line ending and decoded as latin1. A record with an empty
+reader line is a 100ms readline timeout. Lines without a time stamp are
+accepted too, so a raw terminal log of the reader can be replayed as it is.
+"""
+import re
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# serial port setting of the reader
+BAUD = 9600
+# readline timeout of the serial port in seconds
+TIMEOUT = 0.1
+
+STAMP = re.compile(r"^(\d+(?:\.\d*)?)\t")
+
+
+def line_time(line):
+    """
+    Time in seconds the reader needs to send a line at BAUD,
+    or the readline timeout for an empty line
+    """
+    if not line:
+        return TIMEOUT
+    # 10 bits per byte with start and stop bit, plus the CR LF
+    return (len(line)+2)*10/BAUD
+
+
+def read_capture(path):
+    """
+    Read a capture file, return a list of (time, line) with line as bytes,
+    records without a time stamp are timed as the reader would send them
+    """
+    records = []
+    now = 0.0
+    with open(path, 'r', encoding="latin1", newline='\n') as capture:
+        for text in capture:
+            text = text.rstrip("\r\n")
+            stamp = STAMP.match(text)
+            if stamp:
+                now = float(stamp.group(1))
+                line = text[stamp.end():].encode("latin1")
+            else:
+                line = text.encode("latin1")
+                now += line_time(line)
+            records.append((now, line))
+    return records
+
+
+def write_capture(path, records):
+    """
+    Write a list of (time, line) to a capture file
+    """
+    with open(path, 'w', encoding="latin1", newline='\n') as capture:
+        for now, line in records:
+            if isinstance(line, (bytes, bytearray, memoryview)):
+                line = bytes(line).decode("latin1")
+            capture.write("{:.4f}\t{}\n".format(now, line.rstrip("\r\n")))
@@ -0,0 +1,205 @@
+"""
+Station configuration of the Helios Testing Script
+
+Reads station_setup and path_setup once for the GUI and the serial threads,
+and again only when one of the files is modified. station_setup holds the
+station number on the first line, the product line number on the second line
+and optional "name value ..." settings on the following lines, which also
+override the judgement thresholds and window sizes of hts_engine.StationEngine.
+"""
+import os
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Thresholds and window sizes of hts_engine.StationEngine, by attribute name
+ENGINE_DEFAULTS = {"sensor_out_max": 5,
+                   "body_max": 30,
+                   "average_start": 10,
+                   "average_stop": 20,
+                   "average_count": 21,
+                   "average_max": 5,
+                   "charge_target2": 18,
+                   "charge_target4": 15,
+                   "charge_tolerance": 5,
+                   "discharge_max": 5,
+                   "dmm_target": 18,
+                   "dmm_tolerance": 5,
+                   "dmm_difference": 3.5,
+                   "dmm_wait": 1.0}
+# Window sizes and counts of the engine, whole numbers, the other settings are
+# thresholds in mV or seconds and may have decimals
+ENGINE_COUNTS = ("sensor_out_max", "body_max", "average_start", "average_stop", "average_count")
+
+# Product lines known to the log files, any other line number is 'D'
+PRODUCT_LINES = ('0', '1', '2', '3')
+DEFAULT_MES_PATH = "C:\\PCH\\MES\\"
+
+
+def file_mtime(path):
+    """
+    Modification time of a file, None when it does not exist
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read_station_setup(path):
+    """
+    Read the station setup file, return the station number, the product line
+    number and the settings of the following lines as {name: [value, ...]}
+    """
+    try:
+        with open(path, 'r') as setup_file:
+            file_content = setup_file.readlines()
+    except FileNotFoundError:
+        print("No setup file")
+        return "error", 'D', {}
+    first_line = file_content[0].split() if file_content else []
+    if not first_line:
+        print("Empty")
+        return "error", 'D', {}
+    station = first_line[0]
+    print("Test:", station)
+
+    try:
+        second_line = file_content[1].split()
+    except IndexError:
+        second_line = ['0']
+    if second_line and second_line[0] in PRODUCT_LINES:
+        product_line = second_line[0]
+    else:
+        product_line = 'D'
+    print("Line:", product_line)
+
+    options = {}
+    for line in file_content[2:]:
+        words = line.split()
+        if words:
+            options[words[0]] = words[1:]
+    return station, product_line, options
+
+
+def read_path_setup(path):
+    """
+    Read the path_setup file for SUGA MES, return the directory ending with '\\'
+    """
+    try:
+        with open(path, 'r') as path_file:
+            mes_path = path_file.readline().strip()
+    except FileNotFoundError:
+        print("No path file, use C:\\PCH\\MES")
+        return DEFAULT_MES_PATH
+    if not mes_path:
+        return DEFAULT_MES_PATH
+    if mes_path[-1] != '\\':
+        mes_path = mes_path+'\\'
+    return mes_path
+
+
+def calibrations(options):
+    """
+    Gain and offset (mV) of the ADC of every calibrated reader as {port: (gain, offset)},
+    from the setting "calibration <port> <gain> <offset> [<port> <gain> <offset> ...]"
+    """
+    values = options.get("calibration", [])
+    result = {}
+    for position in range(0, len(values) - 2, 3):
+        port_name, gain, offset = values[position: position+3]
+        try:
+            result[port_name] = (float(gain), float(offset))
+        except ValueError:
+            print("Invalid calibration:", port_name, gain, offset)
+    return result
+
+
+def settings_error(settings):
+    """
+    What is wrong in a group of engine settings, None when they fit together
+    """
+    if not (0 <= settings["average_start"] < settings["average_stop"]
+            <= settings["average_count"] < settings["body_max"]):
+        return "0 <= average_start < average_stop <= average_count < body_max is needed"
+    if settings["sensor_out_max"] < 0:
+        return "sensor_out_max is negative"
+    if settings["dmm_wait"] < 0:
+        return "dmm_wait is negative"
+    return None
+
+
+def engine_settings(options, previous=None):
+    """
+    The thresholds and window sizes of the engine, the defaults overridden
+    by the settings of the same name, the previous settings (or the defaults)
+    when they do not fit together
+    """
+    settings = dict(ENGINE_DEFAULTS)
+    for name, default in ENGINE_DEFAULTS.items():
+        values = options.get(name)
+        if not values:
+            continue
+        try:
+            settings[name] = int(values[0]) if name in ENGINE_COUNTS else float(values[0])
+        except ValueError:
+            print("Invalid setting:", name, values[0])
+    error = settings_error(settings)
+    if error is not None:
+        print("Invalid setting:", error)
+        return dict(previous or ENGINE_DEFAULTS)
+    return settings
+
+
+class StationConfig(object):
+    """
+    The content of station_setup and path_setup, shared by the GUI and the
+    serial threads and read again only when a file is modified
+    """
+    def __init__(self, setup_file="station_setup", path_file="path_setup"):
+        self.setup_file = setup_file
+        self.path_file = path_file
+        # settings of the engine, kept when station_setup gives invalid ones
+        self.engine_settings = None
+        self.load()
+
+    def load(self):
+        """
+        Read both files
+        """
+        self.mtimes = (file_mtime(self.setup_file), file_mtime(self.path_file))
+        self.station, self.product_line, self.options = read_station_setup(self.setup_file)
+        self.mes_path = read_path_setup(self.path_file)
+        self.engine_settings = engine_settings(self.options, self.engine_settings)
+        self.calibrations = calibrations(self.options)
+
+    def reload(self):
+        """
+        Read the files again when one of them is modified,
+        return True when the configuration is read again
+        """
+        if (file_mtime(self.setup_file), file_mtime(self.path_file)) == self.mtimes:
+            return False
+        self.load()
+        return True
+
+    def get(self, name, default=None):
+        """
+        The first value of a setting of station_setup
+        """
+        values = self.options.get(name)
+        if not values:
+            return default
+        return values[0]
+
+    def text(self, name, default=None):
+        """
+        The values of a setting of station_setup joined by spaces,
+        for the values which may hold a space
+        """
+        values = self.options.get(name)
+        if not values:
+            return default
+        return " ".join(values)
@@ -0,0 +1,247 @@
+"""
+SQLite result store of the Helios Testing Script
+
+Every result recorded by hts_log.ResultLogger is also kept in a local SQLite
+database, next to the daily csv files, so the history of a UID is found with
+an index instead of searching every csv file. The database is in WAL mode: the
+rows are written by one background thread in batched transactions while the
+GUI and the offline tools read it at the same time.
+
+    python hts_db.py E007A20000012345
+    python hts_db.py --import C:\\PCH\\HeliosLog
+"""
+import argparse
+import collections
+import os
+import queue
+import sqlite3
+import sys
+import threading
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Database of the station, in the directory of the csv files
+DEFAULT_PATH = "C:\\PCH\\HeliosLog\\HeliosResults.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    time TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    line TEXT NOT NULL,
+    station INTEGER NOT NULL,
+    volt1 REAL,
+    dmm REAL,
+    volt2 REAL,
+    volt3 REAL,
+    result INTEGER
+);
+DROP INDEX IF EXISTS results_uid;
+CREATE UNIQUE INDEX IF NOT EXISTS results_unique ON results (uid, time, line, station);
+CREATE INDEX IF NOT EXISTS results_time ON results (time);
+CREATE INDEX IF NOT EXISTS results_station ON results (line, station, time);
+"""
+# Rows of a csv file imported twice into a database made before results_unique
+DEDUPLICATE = """
+DELETE FROM results WHERE rowid NOT IN (SELECT min(rowid) FROM results GROUP BY uid, time, line, station)
+"""
+COLUMNS = ("time", "uid", "line", "station", "volt1", "dmm", "volt2", "volt3", "result")
+# A result already in the database is left out
+INSERT = "INSERT OR IGNORE INTO results ({}) VALUES ({})".format(", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)))
+
+# One row of the results table
+Result = collections.namedtuple("Result", COLUMNS)
+
+
+def connect(path, check_same_thread=True):
+    """
+    Open the database, create its table and indexes when it is new,
+    check_same_thread=False lets other threads use the connection
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    connection = sqlite3.connect(path, timeout=10, check_same_thread=check_same_thread)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # a WAL commit does not wait for the disk, a power loss only loses the last batch
+    connection.execute("PRAGMA synchronous=NORMAL")
+    tables = set(row[0] for row in connection.execute("SELECT name FROM sqlite_master"))
+    if "results" in tables and "results_unique" not in tables:
+        with connection:
+            connection.execute(DEDUPLICATE)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def to_row(line, test, message, now):
+    """
+    Row of the results table of a result message at time now (datetime)
+    """
+    if test == 1 or test == 3:
+        result = message["RES1"]
+    else:
+        result = message["RES2"]
+    return (str(now), message["UID"], line, test, message.get("VOLT1"), message.get("DMM"),
+            message.get("VOLT2"), message.get("VOLT3"), result)
+
+
+def format_result(result):
+    """
+    One line of text of a Result, the empty values left blank
+    """
+    return " ".join("" if value is None else str(value) for value in result)
+
+
+class ResultDatabase(threading.Thread):
+    """
+    Background thread writing the results to the database, the rows queued
+    while a transaction is written go to the next transaction together
+    """
+    def __init__(self, path=DEFAULT_PATH, batch=500, maxsize=10000):
+        threading.Thread.__init__(self, name="Result database", daemon=True)
+        self.path = path
+        # most rows written in one transaction
+        self.batch = batch
+        # rows waiting to be written, None stops the thread
+        self.queue = queue.Queue(maxsize)
+        # connection of the readers, shared by the threads one at a time under reader_lock
+        self.reader = None
+        self.reader_lock = threading.Lock()
+        self.rows = 0
+        self.transactions = 0
+
+    def record(self, line, test, message, now):
+        """
+        Queue a result at time now (datetime) for writing
+        """
+        self.queue.put(to_row(line, test, message, now))
+
+    def run(self):
+        """
+        Write the queued rows until close() is called
+        """
+        try:
+            connection = connect(self.path)
+        except sqlite3.Error as error:
+            print("Result database error:", error)
+            # Keep taking the rows so the testing never waits on the database
+            while self.queue.get() is not None:
+                pass
+            return
+        stop = False
+        while not stop:
+            rows = [self.queue.get()]
+            while len(rows) < self.batch:
+                try:
+                    rows.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in rows:
+                stop = True
+                rows = rows[:rows.index(None)]
+            if not rows:
+                continue
+            try:
+                with connection:
+                    connection.executemany(INSERT, rows)
+                self.rows += len(rows)
+                self.transactions += 1
+            except sqlite3.Error as error:
+                print("Result database error:", error)
+        connection.close()
+
+    def query(self, sql, parameters=()):
+        """
+        Run a query on the reader connection, return the rows as Result
+        """
+        with self.reader_lock:
+            if self.reader is None:
+                self.reader = connect(self.path, check_same_thread=False)
+            return [Result(*row) for row in self.reader.execute(sql, parameters)]
+
+    def lookup(self, uid):
+        """
+        Every result of a UID, the oldest one first
+        """
+        return self.query("SELECT {} FROM results WHERE uid = ? ORDER BY time".format(", ".join(COLUMNS)), (uid,))
+
+    def results(self, since=None, until=None, line=None, station=None):
+        """
+        The results between the times since and until (text, like "2018-05-31"),
+        of a product line and station when given, the oldest one first
+        """
+        conditions = []
+        parameters = []
+        for column, operator, value in (("line", "=", line), ("station", "=", station),
+                                        ("time", ">=", since), ("time", "<", until)):
+            if value is not None:
+                conditions.append("{} {} ?".format(column, operator))
+                parameters.append(value)
+        sql = "SELECT {} FROM results".format(", ".join(COLUMNS))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.query(sql + " ORDER BY time", parameters)
+
+    def close(self):
+        """
+        Write the queued rows and stop the thread
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        with self.reader_lock:
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+
+
+def import_logs(path, log_paths):
+    """
+    Add the rows of the HeliosLog csv files to the database, return the number
+    of rows added, the rows already in the database are left out
+    """
+    import hts_stats
+    connection = connect(path)
+    count = 0
+    for log_path in hts_stats.find_logs(log_paths):
+        station, line, day = hts_stats.parse_name(log_path)
+        rows = []
+        with open(log_path, 'r', newline='') as log_file:
+            for row in log_file.read().splitlines():
+                fields = [field if field else None for field in row.split(",")]
+                if station == 1 or station == 3:
+                    if len(fields) == 4:
+                        rows.append((fields[0], fields[1], line, station, fields[2], None, None, None, fields[3]))
+                elif len(fields) == 6:
+                    rows.append((fields[0], fields[1], line, station, None) + tuple(fields[2:]))
+        with connection:
+            count += connection.executemany(INSERT, rows).rowcount
+    connection.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("uid", nargs="*", help="UIDs to look up")
+    parser.add_argument("--database", default=DEFAULT_PATH, help="database file")
+    parser.add_argument("--import", dest="logs", nargs="+", help="add the csv files of these directories, files or patterns")
+    args = parser.parse_args(argv)
+
+    if args.logs:
+        print(import_logs(args.database, args.logs), "rows imported")
+    if args.uid:
+        database = ResultDatabase(args.database)
+        for uid in args.uid:
+            results = database.lookup(uid)
+            if not results:
+                print(uid, "not tested")
+            for result in results:
+                print(format_result(result))
+        database.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
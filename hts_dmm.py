@@ -0,0 +1,342 @@
+"""
+Rigol DMM service for the Helios Testing Script
+
+The service thread finds the Rigol DMM among the VISA resources once, keeps
+the session open and measures the DC voltage when asked, so the Tk thread never
+waits on VISA. The session is opened again after a failure. The VISA backend
+can be pyvisa-sim with rigol_sim.yaml to run without the instrument.
+
+In the "measure" mode every reading is a :MEASure:VOLTage:DC? query, which sets
+up the function, the range and the integration time again each time. The
+"read" mode sets them up once when the session is opened and then only sends
+READ? for a reading.
+
+The readings of a reader are kept with their time in DmmReadings, so the engine
+takes the reading closest to the charged voltage of the part instead of the
+last one put in a queue. DmmSampler can measure the DMM continuously into them.
+"""
+import collections
+import queue
+import statistics
+import threading
+import time
+try:
+    import pyvisa as visa
+except ImportError:
+    # older PyVISA releases
+    import visa
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Reading of a failed measurement, judged as REDO like a missing reading
+NO_READING = -1
+
+
+def to_millivolt(answer):
+    """
+    Convert the answer of the DMM in V to a voltage in mV
+    """
+    return round(float(answer)*1000, 2)
+
+
+# Statistics of the DMM readings
+DmmStats = collections.namedtuple("DmmStats", ["count", "mean", "stdev", "minimum", "maximum"])
+
+
+class DmmReadings(object):
+    """
+    Ring buffer of the last DMM readings of a reader with their time.monotonic()
+    time, shared by the DMM service and the serial thread. The readings come
+    from the one service thread, so they are in time order.
+    """
+    def __init__(self, size=64):
+        # (time, voltage in mV) of the readings, the oldest ones are overwritten
+        self.size = size
+        self.times = [0.0] * size
+        self.voltages = [0.0] * size
+        # number of readings kept and index of the next one
+        self.count = 0
+        self.end = 0
+        # number of requested measurements not read yet
+        self.pending = 0
+        self.lock = threading.Lock()
+        # called without arguments after a reading is kept, from the DMM service thread
+        self.listener = None
+
+    def request(self):
+        """
+        Count a measurement which is requested, before asking the DMM service
+        """
+        with self.lock:
+            self.pending += 1
+
+    def add(self, when, voltage, requested=True):
+        """
+        Keep a reading, requested tells if it was counted by request()
+        """
+        with self.lock:
+            self.times[self.end] = when
+            self.voltages[self.end] = voltage
+            self.end = (self.end + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+            if requested and self.pending:
+                self.pending -= 1
+        listener = self.listener
+        if listener is not None:
+            listener()
+
+    def waiting(self):
+        """
+        True while a requested measurement is not read yet
+        """
+        return self.pending > 0
+
+    def index(self, number):
+        """
+        Index in the ring of a reading, number 0 is the oldest one
+        """
+        return (self.end - self.count + number) % self.size
+
+    def nearest(self, when, since=None):
+        """
+        The reading closest to the time when, taken after the time since,
+        None when there is none
+        """
+        with self.lock:
+            # only the readings from first on are taken after since
+            first = 0
+            if since is not None:
+                first = self.search(since, True)
+            low = self.search(when, False, first)
+            best = None
+            for number in (low - 1, low):
+                if number < first or number >= self.count:
+                    continue
+                index = self.index(number)
+                if best is None or abs(self.times[index] - when) < abs(self.times[best] - when):
+                    best = index
+            if best is None:
+                return None
+            return self.voltages[best]
+
+    def search(self, when, after, low=0):
+        """
+        Number of the first reading taken at or after the time when,
+        strictly after it when after is True, the lock must be held
+        """
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            reading_time = self.times[self.index(middle)]
+            if reading_time < when or (after and reading_time == when):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def stats(self, since=None):
+        """
+        Statistics of the readings taken after the time since, without the
+        failed ones, None when there is none
+        """
+        with self.lock:
+            voltages = [self.voltages[self.index(number)] for number in range(self.count)
+                        if since is None or self.times[self.index(number)] > since]
+        voltages = [voltage for voltage in voltages if voltage != NO_READING]
+        if not voltages:
+            return None
+        return DmmStats(len(voltages), statistics.mean(voltages), statistics.pstdev(voltages),
+                        min(voltages), max(voltages))
+
+    def clear(self):
+        """
+        Forget the readings
+        """
+        with self.lock:
+            self.count = 0
+
+
+class DmmSampler(threading.Thread):
+    """
+    Background thread measuring the DMM at a fixed interval through the DMM
+    service, the readings go to every DmmReadings of stores
+    """
+    def __init__(self, service, stores, interval=0.1):
+        threading.Thread.__init__(self, name="DMM sampler", daemon=True)
+        self.service = service
+        self.stores = stores
+        # time (s) between the starts of two measurements
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.done = threading.Event()
+
+    def run(self):
+        """
+        Measure until close() is called, one measurement at a time
+        """
+        next_time = time.monotonic()
+        while not self.stop_event.is_set():
+            self.done.clear()
+            self.service.measure(self.sampled)
+            self.done.wait()
+            # a slow measurement delays the next one instead of queueing them up
+            next_time = max(next_time + self.interval, time.monotonic())
+            self.stop_event.wait(next_time - time.monotonic())
+
+    def sampled(self, voltage, when):
+        """
+        Keep a reading, called from the DMM service
+        """
+        if voltage != NO_READING:
+            for store in self.stores:
+                store.add(when, voltage, requested=False)
+        self.done.set()
+
+    def close(self):
+        """
+        Stop the thread, the DMM service must still be running
+        """
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+class DmmService(threading.Thread):
+    """
+    Background thread owning the VISA session of the Rigol DMM
+    """
+    def __init__(self, backend="", resource=None, idn="RIGOL", mode="measure", voltage_range="AUTO", nplc=None):
+        threading.Thread.__init__(self, name="DMM service", daemon=True)
+        # VISA library, "" for the default one, "rigol_sim.yaml@sim" for pyvisa-sim
+        self.backend = backend
+        # resource name of the DMM, found by the *IDN? answer when not given
+        self.resource = resource
+        self.idn = idn
+        # "measure" or "read", the DC voltage range (V or AUTO) and the
+        # integration time (power line cycles, None for the DMM setting) of the read mode
+        self.mode = mode
+        self.voltage_range = voltage_range
+        self.nplc = nplc
+        # callbacks waiting for a measurement, None stops the thread
+        self.requests = queue.Queue()
+        self.rm = None
+        self.inst = None
+
+    def measure(self, callback):
+        """
+        Ask for a measurement, callback is called with the voltage in mV
+        (NO_READING when it fails) and the time.monotonic() time of the
+        measurement in the service thread
+        """
+        self.requests.put(callback)
+
+    def run(self):
+        """
+        Measure for every request until close() is called
+        """
+        while True:
+            callback = self.requests.get()
+            if callback is None:
+                break
+            start = time.monotonic()
+            voltage = self.read()
+            # the middle of the query is the best guess of the time of the measurement
+            try:
+                callback(voltage, (start + time.monotonic()) / 2)
+            except Exception as error:
+                print("DMM callback error:", error)
+        self.disconnect()
+
+    def find(self):
+        """
+        Find the resource name of the DMM, None when it is not connected
+        """
+        for name in self.rm.list_resources():
+            try:
+                inst = self.rm.open_resource(name)
+            except Exception:
+                continue
+            try:
+                answer = inst.query("*IDN?")
+            except Exception:
+                answer = ""
+            finally:
+                inst.close()
+            if self.idn.upper() in answer.upper():
+                print(answer.strip())
+                return name
+        return None
+
+    def connect(self):
+        """
+        Open the session of the DMM when it is not open, None when there is no DMM
+        """
+        if self.inst is None:
+            if self.rm is None:
+                self.rm = visa.ResourceManager(self.backend)
+            name = self.resource or self.find()
+            if name is None:
+                print("no rigol")
+                return None
+            inst = self.rm.open_resource(name)
+            if self.mode == "read":
+                self.configure(inst)
+            self.inst = inst
+            self.resource = name
+        return self.inst
+
+    def configure(self, inst):
+        """
+        Set up the DC voltage measurement of the read mode
+        """
+        inst.write(":CONFigure:VOLTage:DC {}".format(self.voltage_range))
+        if self.nplc is not None:
+            inst.write(":VOLTage:DC:NPLC {}".format(self.nplc))
+        inst.write(":TRIGger:SOURce IMMediate")
+
+    def disconnect(self):
+        """
+        Close the session of the DMM
+        """
+        if self.inst is not None:
+            try:
+                self.inst.close()
+            except Exception:
+                pass
+            self.inst = None
+
+    def query(self, inst):
+        """
+        Measure the DC voltage in V
+        """
+        if self.mode == "read":
+            return inst.query(":READ?")
+        return inst.query(":measure:voltage:dc?")
+
+    def read(self):
+        """
+        Measure the DC voltage in mV, open the session again once when it fails
+        """
+        # The VISA backends raise their own errors, any of them means a lost session
+        for attempt in range(2):
+            try:
+                inst = self.connect()
+                if inst is None:
+                    return NO_READING
+                return to_millivolt(self.query(inst))
+            except Exception as error:
+                print("DMM error:", error)
+                self.disconnect()
+        return NO_READING
+
+    def close(self):
+        """
+        Stop the thread after the pending measurements
+        """
+        self.requests.put(None)
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,393 @@
+"""
+Headless acquisition engine for the Helios Testing Script
+
+The engine holds the UID/"Block 04 Data:" state machine and the station 1-4
+judgement that used to live inside HTS.SerialThread.run. It knows nothing about
+pyserial, Tk or the log files: feed it the lines read from the MSP430 reader
+(an empty line is a 100ms readline timeout) and it returns the events the
+caller has to show or record. With capture set, it also keeps the ADC words
+of every part for hts_trace.
+"""
+import array
+import collections
+import time
+import hts_adc
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Event kinds returned by StationEngine.feed
+RESET = "reset"
+UID = "uid"
+RESULT = "result"
+
+Event = collections.namedtuple("Event", ["kind", "message"])
+
+# ADC words of one part, with the time.time() times of its UID and of its removal
+Trace = collections.namedtuple("Trace", ["uid", "test", "start", "stop", "words"])
+
+# Line kinds returned by classify
+LINE_UID = "uid"
+LINE_WORD = "word"
+LINE_BLOCK = "block"
+# shared results of classify for the lines without a value
+NOTHING = (None, None)
+BLOCK = (LINE_BLOCK, None)
+
+
+def empty_message():
+    """
+    Create a message for UI update with every field cleared
+    """
+    return {"UID": None,
+            "VOLT1": None,
+            "RES1": None,
+            "DMM": None,
+            "VOLT2": None,
+            "VOLT3": None,
+            "RES2": None}
+
+
+# Convert the ADC word to a voltage in mV
+adc_to_voltage = hts_adc.to_millivolt
+
+
+def classify(line, want_uid, want_word):
+    """
+    Classify a raw line of the reader in one pass and return (kind, value):
+    the UID of a "UID: [E007A20000001234]" line when want_uid, otherwise the
+    byte-swapped ADC word of a "Block 04 Data: [0000LLHH]" line when want_word
+    (None when it is not a hex number), (None, None) for a line irrelevant to
+    the current state
+    """
+    # Searching a latin1 str is several times faster than searching bytes
+    # in CPython, and the decoding is a plain copy of the short line
+    if isinstance(line, bytes):
+        line = line.decode("latin1")
+    elif not isinstance(line, str):
+        # bytearray or memoryview frame of a chunk reader
+        line = str(line, "latin1")
+    if want_uid:
+        if "UID:" not in line:
+            return NOTHING
+        return LINE_UID, line[line.find('[')+1: line.find(']')]
+
+    if "Block 04 Data:" not in line:
+        return NOTHING
+    if not want_word:
+        return BLOCK
+    position = line.find('[') + 5
+    try:
+        return LINE_WORD, int(line[position+2: position+4] + line[position: position+2], 16)
+    except ValueError:
+        return LINE_WORD, None
+
+
+class StationEngine(object):
+    """
+    State machine for one reader, one line of reader output at a time
+    """
+    def __init__(self, test=1, dmm=None):
+        # test station number, 1 to 4
+        self.test = test
+        # timestamped DMM readings (hts_dmm.DmmReadings), only used in station 2
+        self.dmm = dmm
+        # clock of the reading times of dmm
+        self.clock = time.monotonic
+        # conversion of the ADC word to mV, Calibration.to_millivolt of the reader when calibrated
+        self.convert = adc_to_voltage
+        # maximum time of the sensor left the board
+        self.sensor_out_max = 5
+        # maximum iteration of the sensor stay on the board
+        self.body_max = 30
+        # station #1 and station #3 average the ADC values from average_start
+        # to average_stop-1 and judge at average_count
+        self.average_start = 10
+        self.average_stop = 20
+        self.average_count = 21
+        # maximum average voltage of a good part
+        self.average_max = 5
+        # charged voltage of station #2 and station #4 and its tolerance
+        self.charge_target2 = 18
+        self.charge_target4 = 15
+        self.charge_tolerance = 5
+        # maximum discharged voltage
+        self.discharge_max = 5
+        # DMM voltage of station #2, its tolerance and
+        # the maximum difference to the charged voltage
+        self.dmm_target = 18
+        self.dmm_tolerance = 5
+        self.dmm_difference = 3.5
+        # maximum time (s) to wait for a requested DMM reading after the charged voltage
+        self.dmm_wait = 1.0
+        # keep the ADC words of every part, the last trace_max words of a part at most
+        self.capture = False
+        self.trace_max = 1000
+        # Trace of the last part taken away, until the caller takes it
+        self.trace = None
+        self.reset()
+
+    def configure(self, settings):
+        """
+        Set the thresholds and window sizes from {attribute name: value},
+        like hts_config.StationConfig.engine_settings
+        """
+        for name, value in settings.items():
+            if hasattr(self, name):
+                setattr(self, name, value)
+
+    def reset(self):
+        """
+        Clear everything about the sensor on the board
+        """
+        # variable for counting the time when the sensor left the board
+        self.sensor_out_count = 0
+        # set when a line shows the sensor is still on the board
+        self.sensor_seen = False
+        # variable for storing the UID from the first iteration of the sensor reading
+        self.head = ""
+        # variable for counting the number iteration when the senosr stay on the board
+        self.body_count = 0
+        self.voltage_sum = 0
+        self.voltage2 = None
+        self.voltage3 = None
+        # only the DMM readings taken after the last part are used
+        self.reset_time = self.clock()
+        # time of the charged voltage
+        self.charge_time = None
+        # set while the judgement of station #2 waits for the DMM reading
+        self.dmm_waiting = False
+        # ADC words of the sensor on the board when captured, and the time of its UID
+        self.words = None
+        self.trace_start = None
+        # message for UI update
+        self.message = empty_message()
+
+    def feed(self, read_out):
+        """
+        Process one line read from the serial port and return a list of events,
+        read_out is a bytes-like or str line, empty when the readline timed out
+        """
+        events = []
+
+        # Judge when the DMM reading the judgement waits for is there
+        if self.dmm_waiting:
+            self.check_dmm(events)
+
+        # The processing will reset when the sensor is out for a while
+        if not read_out:
+            self.timeout(events)
+            return events
+
+        # Only a UID line matters before the sensor is detected,
+        # only a Block 04 line matters after it
+        # every word is wanted when the words are captured
+        kind, value = classify(read_out, not self.head, self.body_count < self.body_max or self.capture)
+
+        # Acquire the first iteration UID and the following ADC data
+        if kind == LINE_UID:
+            # Get the first iteration UID and assign it to head
+            self.head = value
+            # Reset body message counting
+            self.body_count = 0
+            self.sensor_seen = True
+            # Store the head into the message
+            self.message["UID"] = self.head
+            if self.capture:
+                self.words = array.array('H')
+                self.trace_start = time.time()
+            # Update the UI to show the UID
+            events.append(Event(UID, dict(self.message)))
+
+        # Acquire the ADC value
+        elif kind == LINE_WORD:
+            # Necessary to reset the sensor_out_cout because
+            # there is an empty reading after each iteration
+            self.sensor_out_count = 0
+            self.sensor_seen = True
+            if value is not None:
+                if self.words is not None and len(self.words) < self.trace_max:
+                    self.words.append(value & 0xFFFF)
+                # convert the ADC value to a voltage, the captured words
+                # after the judgement are not processed
+                if self.body_count < self.body_max:
+                    self.body(self.convert(value), events)
+
+        # Do nothing when the iterating count reach to max
+        elif kind == LINE_BLOCK:
+            self.sensor_out_count = 0
+            self.sensor_seen = True
+
+        return events
+
+    def timeout(self, events):
+        """
+        Count one empty reading, reset when the sensor is out for a while
+        """
+        if self.head and self.sensor_out_count < self.sensor_out_max:
+            # Count the time of sensor out
+            self.sensor_out_count += 1
+        elif self.head and self.sensor_out_count == self.sensor_out_max:
+            # Judge without the DMM reading when the sensor is gone
+            if self.dmm_waiting:
+                self.finish_charge(events)
+            if self.words is not None:
+                self.trace = Trace(self.head, self.test, self.trace_start, time.time(), self.words)
+            # When the time of sensor out reach to maximum, send a empty message to reset UI
+            self.reset()
+            events.append(Event(RESET, dict(self.message)))
+
+    def sensor_removed(self):
+        """
+        Reset at once when the sensor is known to be taken away,
+        used instead of counting the empty readings
+        """
+        events = []
+        if self.head:
+            self.sensor_out_count = self.sensor_out_max
+            self.timeout(events)
+        return events
+
+    def body(self, voltage, events):
+        """
+        Process one ADC voltage of the sensor on the board
+        """
+        test = self.test
+        # When station #1 and staion #3
+        if test == 1 or test == 3:
+            if self.body_count == 0:
+                # When iteration counting is zero, that means there is a new sensor on board
+                # Clean the previous data
+                self.voltage_sum = 0
+            elif self.body_count >= self.average_start and self.body_count < self.average_stop:
+                # Do nothing for the first 10 sets of data
+                # Sum up the following 10 sets of data
+                self.voltage_sum += voltage
+            elif self.body_count == self.average_count:
+                # Set the iteration counting to max,
+                # when it reach to the 21st set of ADC value by default.
+                # It will stop recording the block 04 data
+                # At this time, count the average value
+                self.body_count = self.body_max
+                self.judge_average(self.voltage_sum/(self.average_stop-self.average_start))
+                events.append(Event(RESULT, dict(self.message)))
+
+        # When station #2 and station #4
+        elif test == 2 or test == 4:
+            if self.body_count == 0:
+                # When interation counting is zero, it means the UID is detect
+                # At the same time, it will come with the first set of ADC value
+                # the first set of ADC value is the charged value
+                self.voltage2 = voltage
+                self.charge_time = self.clock()
+            elif self.body_count == 1:
+                # Set the iteration counting to max,
+                # when it reach to the 2nd set of ADC value.
+                # It will stop recording the block 04 data.
+                # the second set of ADC value is the discharged value
+                self.body_count = self.body_max
+                self.voltage3 = voltage
+                if test == 2 and self.dmm_reading() is None and self.dmm is not None and self.dmm.waiting():
+                    # The DMM measurement triggered by the UID is not read yet
+                    self.dmm_waiting = True
+                else:
+                    self.finish_charge(events)
+
+        # Finish one iteration processing
+        self.body_count += 1
+
+    def dmm_reading(self):
+        """
+        The DMM reading of the part, the one taken after the last part
+        closest to the charged voltage, None when there is none
+        """
+        if self.dmm is None:
+            return None
+        return self.dmm.nearest(self.charge_time, self.reset_time)
+
+    def check_dmm(self, events):
+        """
+        Judge station #2 when the DMM reading arrives or is not coming any more
+        """
+        if (self.dmm_reading() is not None or not self.dmm.waiting()
+                or self.clock() - self.charge_time > self.dmm_wait):
+            self.finish_charge(events)
+
+    def finish_charge(self, events):
+        """
+        Judge the charged/discharged voltage and send the result
+        """
+        self.dmm_waiting = False
+        self.judge_charge(self.voltage2, self.voltage3)
+        events.append(Event(RESULT, dict(self.message)))
+
+    def judge_average(self, voltage_avg):
+        """
+        Judge the average voltage of station #1 and station #3
+        """
+        # IMPORTANT: Do the judgement
+        if voltage_avg > self.average_max:
+            # Error code
+            res = self.test * 10 + 1
+        else:
+            # Error code
+            res = self.test * 10
+        # write the result to the message
+        self.message["VOLT1"] = voltage_avg
+        self.message["RES1"] = res
+
+    def judge_charge(self, voltage2, voltage3):
+        """
+        Judge the charged/discharged voltage of station #2 and station #4
+        """
+        message = self.message
+        test = self.test
+        # write the result to the message
+        message["VOLT2"] = voltage2
+        message["VOLT3"] = voltage3
+        dmm_voltage = self.dmm_reading() if test == 2 else None
+        # if it is station #2, check if any DMM input value exist
+        if test == 2 and dmm_voltage is None:
+            message["RES2"] = 99
+        # if DMM input value exist
+        elif test == 2:
+            message["DMM"] = dmm_voltage
+            # check if the DMM input value is invalid
+            # IMPORTANT: Do the judgement
+            if dmm_voltage == -1:
+                message["DMM"] = None
+                # Error code
+                message["RES2"] = 99
+            # When charged voltage out of 18V +/- 5V
+            elif abs(voltage2-self.charge_target2) > self.charge_tolerance:
+                # Error code
+                message["RES2"] = 21
+            # When discharged voltage out of 0 +/- 5V
+            elif voltage3 > self.discharge_max:
+                # Error code
+                message["RES2"] = 22
+            # When DMM voltage out of 18V +/- 5V
+            elif abs(dmm_voltage-self.dmm_target) > self.dmm_tolerance:
+                # Error code
+                message["RES2"] = 23
+            # When the different between charged voltage and DMM voltage
+            # greater than 3.5V
+            elif abs(voltage2-dmm_voltage) > self.dmm_difference:
+                # Error code
+                message["RES2"] = 24
+            else:
+                message["RES2"] = 20
+        # if it is station #4
+        elif test == 4:
+            # When charged voltage out of 15V +/- 5V
+            if abs(voltage2-self.charge_target4) > self.charge_tolerance:
+                # Error code
+                message["RES2"] = 41
+            # When discharged voltage out of 0 +/- 5V
+            elif voltage3 > self.discharge_max:
+                # Error code
+                message["RES2"] = 42
+            else:
+                message["RES2"] = 40
@@ -0,0 +1,291 @@
+"""
+FTP upload of the HeliosLog csv files for the Helios Testing Script
+
+The uploader thread keeps one FTP session open and uploads the files queued by
+the logger in the background. A file queued again before it is uploaded is
+uploaded once, so a burst of parts costs one upload, and a failed upload is
+retried on a new session after a growing delay. A failed file is retried
+behind the other files, and given up after retry_limit attempts until it is
+queued again, so one bad file does not hold back the others.
+
+The csv files only grow during the day, so only the bytes added since the last
+upload are sent, appended to the remote file with APPE. The remote size tells
+where to start after a restart or a failure and checks every upload.
+"""
+import ftplib
+import os
+import threading
+import time
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# PCH FTP server of the HeliosLog files
+HOST = "pchintl.net"
+USER = "L'Oreal Helios"
+PASSWORD = "PCH#2018"
+DIRECTORY = "HeliosLog"
+
+
+class LocalFileError(Exception):
+    """
+    A local file could not be read, the FTP session is not involved
+    """
+
+
+class FtpUploader(threading.Thread):
+    """
+    Background thread uploading the queued files to the FTP server
+    """
+    def __init__(self, host=HOST, user=USER, password=PASSWORD, directory=DIRECTORY, port=21,
+                 delay=1.0, retry_min=1.0, retry_max=60.0, timeout=30, retry_limit=5):
+        threading.Thread.__init__(self, name="FTP uploader", daemon=True)
+        self.host = host
+        self.user = user
+        self.password = password
+        # remote directory holding a sub-directory for each station, like "HeliosLog/Test1"
+        self.directory = directory
+        self.port = port
+        # time (s) to wait after a file is queued, for the following parts of a burst
+        self.delay = delay
+        # delay (s) before the first retry, doubled up to retry_max
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.timeout = timeout
+        # failed attempts of a file before it is given up
+        self.retry_limit = retry_limit
+        # failed attempts of each file since its last upload
+        self.attempts = {}
+        # file names waiting for upload, in order of the first request
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.stopped = False
+        # open FTP session, None when disconnected
+        self.ftp = None
+        # login directory and current directory of the session
+        self.home = None
+        self.current = None
+        # bytes of each file known to be on the server
+        self.sent = {}
+        # number of completed and failed uploads, bytes uploaded
+        self.uploads = 0
+        self.failures = 0
+        self.bytes_sent = 0
+
+    def upload(self, file_name):
+        """
+        Queue a file for upload, returns at once
+        """
+        with self.condition:
+            self.pending[file_name] = None
+            self.condition.notify()
+
+    def run(self):
+        """
+        Upload the queued files until close() is called
+        """
+        retry = self.retry_min
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    break
+                # Let the following parts of a burst join the upload
+                self.wait(self.delay)
+                file_names = list(self.pending)
+                self.pending.clear()
+
+            try:
+                self.connect()
+            except ftplib.all_errors as error:
+                print("FTP connection error:", error)
+                self.failures += 1
+                # No file was tried, they keep their place
+                if not self.requeue(file_names, [], retry):
+                    break
+                retry = min(retry * 2, self.retry_max)
+                continue
+
+            for number, file_name in enumerate(file_names):
+                try:
+                    self.send(file_name)
+                except LocalFileError as error:
+                    # The session is still good, go on with the other files
+                    print("FTP upload error:", error)
+                    self.failures += 1
+                    if self.can_retry(file_name):
+                        with self.condition:
+                            if not self.stopped:
+                                self.pending[file_name] = None
+                except ftplib.all_errors as error:
+                    print("FTP upload error:", error)
+                    self.failures += 1
+                    self.disconnect()
+                    # The files not tried yet go first, the failed one behind the others
+                    failed = [file_name] if self.can_retry(file_name) else []
+                    if self.requeue(file_names[number+1:], failed, retry):
+                        retry = min(retry * 2, self.retry_max)
+                    break
+                else:
+                    self.uploads += 1
+                    self.attempts.pop(file_name, None)
+                    retry = self.retry_min
+        self.disconnect()
+
+    def can_retry(self, file_name):
+        """
+        Count a failed attempt of a file, False when it is given up
+        """
+        attempts = self.attempts.get(file_name, 0) + 1
+        if attempts < self.retry_limit:
+            self.attempts[file_name] = attempts
+            return True
+        print("FTP upload given up after {} attempts: {}".format(attempts, file_name))
+        self.attempts.pop(file_name, None)
+        return False
+
+    def requeue(self, first, last, seconds):
+        """
+        Queue the files of first before the newer ones and the files of last
+        behind them, then wait before the retry, False when close() was called
+        """
+        with self.condition:
+            pending = dict.fromkeys(first)
+            pending.update(self.pending)
+            for file_name in last:
+                pending.pop(file_name, None)
+                pending[file_name] = None
+            self.pending = pending
+            if self.stopped:
+                self.pending.clear()
+                return False
+            self.wait(seconds)
+        return True
+
+    def wait(self, seconds):
+        """
+        Wait for some time or until close() is called, with the condition held
+        """
+        deadline = time.monotonic() + seconds
+        remaining = seconds
+        while not self.stopped and remaining > 0:
+            self.condition.wait(remaining)
+            remaining = deadline - time.monotonic()
+
+    def connect(self):
+        """
+        Open the FTP session when it is not open
+        """
+        if self.ftp is None:
+            ftp = ftplib.FTP(timeout=self.timeout)
+            try:
+                ftp.connect(self.host, self.port)
+                ftp.login(self.user, self.password)
+                self.home = ftp.pwd()
+                # binary mode, so the remote size is the local size
+                ftp.voidcmd("TYPE I")
+            except ftplib.all_errors:
+                ftp.close()
+                raise
+            self.ftp = ftp
+            self.current = self.home
+        return self.ftp
+
+    def disconnect(self):
+        """
+        Close the FTP session
+        """
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except ftplib.all_errors:
+                self.ftp.close()
+            self.ftp = None
+            self.current = None
+
+    def remote_directory(self, file_name):
+        """
+        Remote directory of a log file, "Test1_LineD_2018-01-01.csv" goes to HeliosLog/Test1
+        """
+        return self.directory+"/"+os.path.basename(file_name)[0:5]
+
+    def change_directory(self, ftp, directory):
+        """
+        Change to a remote directory under the login directory, creating it when needed
+        """
+        # the session stays in the directory of the last upload
+        if directory == self.current:
+            return
+        ftp.cwd(self.home)
+        try:
+            ftp.cwd(directory)
+        except ftplib.error_perm:
+            ftp.mkd(directory)
+            ftp.cwd(directory)
+        self.current = directory
+
+    def remote_size(self, ftp, name):
+        """
+        Size of a file in the current remote directory, 0 when it does not exist
+        """
+        try:
+            return ftp.size(name)
+        except ftplib.error_perm:
+            return 0
+
+    def send(self, file_name):
+        """
+        Upload the bytes of a file which are not on the server yet, raise
+        LocalFileError when the file cannot be read and ftplib.all_errors
+        when the upload fails
+        """
+        try:
+            fobj = open(file_name, 'rb')
+        except OSError as error:
+            raise LocalFileError(error)
+        with fobj:
+            self.send_file(fobj, file_name)
+
+    def send_file(self, fobj, file_name):
+        """
+        Upload the bytes of an open file which are not on the server yet
+        """
+        ftp = self.connect()
+        self.change_directory(ftp, self.remote_directory(file_name))
+        name = os.path.basename(file_name)
+        # Ask the server after a restart or a failed upload
+        offset = self.sent.pop(file_name, None)
+        if offset is None:
+            offset = self.remote_size(ftp, name)
+        size = os.fstat(fobj.fileno()).st_size
+        if offset == size:
+            self.sent[file_name] = size
+            return
+        if offset > size:
+            # The remote file is not a copy of this one, replace it
+            offset = 0
+        fobj.seek(offset)
+        if offset:
+            ftp.storbinary("APPE " + name, fobj)
+        else:
+            ftp.storbinary("STOR " + name, fobj)
+        end = fobj.tell()
+        # Check the upload, a wrong size is found out again at the next upload
+        remote = self.remote_size(ftp, name)
+        if remote != end:
+            raise ftplib.error_reply("size of {} is {} instead of {}".format(name, remote, end))
+        self.sent[file_name] = end
+        self.bytes_sent += end - offset
+
+    def close(self, timeout=None):
+        """
+        Upload the queued files once more, then stop the thread
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,277 @@
+"""
+Result logging back end for the Helios Testing Script
+
+Writes the daily HeliosLog csv files and the per-part SUGA MES files for the
+results produced by hts_engine.StationEngine. The MES files are written by a
+background thread, each one under a temporary name first and then renamed, so
+SUGA MES never reads a partial file. The results can also be kept in the
+SQLite database of hts_db.
+"""
+import csv
+import datetime
+import os
+import queue
+import threading
+import time
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Message keys of the fields following the time
+FIELD_KEYS = {1: ("UID", "VOLT1", "RES1"),
+              2: ("UID", "DMM", "VOLT2", "VOLT3", "RES2"),
+              3: ("UID", "VOLT1", "RES1"),
+              4: ("UID", "DMM", "VOLT2", "VOLT3", "RES2")}
+# Longest time (s) the closing waits for the last upload of the csv files,
+# an unfinished upload is resumed from the remote size at the next start
+UPLOAD_CLOSE_TIMEOUT = 5.0
+
+
+class CsvLog(object):
+    """
+    Daily csv log file of one station, kept open between the results
+    and replaced by the file of the next day at midnight
+    """
+    def __init__(self, log_dir, test, line, flush_rows=1, flush_ms=0):
+        self.log_dir = log_dir
+        self.test = test
+        self.line = line
+        # flush after this number of rows, 0 for no limit
+        self.flush_rows = flush_rows
+        # flush when the oldest unflushed row is this old (ms), 0 for no limit
+        self.flush_ms = flush_ms
+        self.keys = FIELD_KEYS[test]
+        self.file = None
+        self.writer = None
+        self.date = None
+        self.file_name = None
+        self.unflushed = 0
+        self.unflushed_since = 0
+
+    def open(self, date):
+        """
+        Open the file of a day for appending
+        """
+        self.close()
+        self.date = date
+        self.file_name = os.path.join(self.log_dir, "Test"+str(self.test)+"_Line"+self.line+'_'+str(date)+".csv")
+        self.file = open(self.file_name, 'a', newline='')
+        self.writer = csv.writer(self.file)
+
+    def write(self, message, now):
+        """
+        Write the result in a message as a row with time stamp now (datetime)
+        """
+        if now.date() != self.date:
+            self.open(now.date())
+        row = [str(now)]
+        row.extend(message[key] for key in self.keys)
+        self.writer.writerow(row)
+        if not self.unflushed:
+            self.unflushed_since = time.monotonic()
+        self.unflushed += 1
+        if self.flush_rows and self.unflushed >= self.flush_rows:
+            self.flush()
+        elif self.flush_ms:
+            self.flush_due()
+
+    def flush_due(self):
+        """
+        Flush when the oldest unflushed row is older than flush_ms
+        """
+        if self.unflushed and (time.monotonic() - self.unflushed_since)*1000 >= self.flush_ms:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows to the file
+        """
+        if self.file is not None:
+            self.file.flush()
+        self.unflushed = 0
+
+    def close(self):
+        """
+        Flush and close the file
+        """
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+class WriterThread(threading.Thread):
+    """
+    Background thread calling write with every item put in a bounded queue,
+    put blocks while the queue is full
+    """
+    def __init__(self, write, maxsize=1000, name=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.write = write
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, item):
+        """
+        Queue an item for writing
+        """
+        self.queue.put(item)
+
+    def run(self):
+        """
+        Write the queued items until close() is called
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.write(item)
+            except Exception as error:
+                print("{} error: {}".format(self.name, error))
+
+    def close(self):
+        """
+        Write the queued items and stop the thread
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+
+class ResultLogger(object):
+    """
+    Record the test results to the log files
+    """
+    def __init__(self, line, version, log_dir="C:\\PCH\\HeliosLog", mes_dir="C:\\PCH\\MES", flush_rows=1, flush_ms=0, uploader=None, database=None):
+        # product line number
+        self.line = line
+        # version of the testing script, written to the MES file
+        self.version = version
+        # directory of the daily csv files
+        self.log_dir = log_dir
+        # directory of the MES files, see hts_config.read_path_setup
+        self.mes_dir = mes_dir
+        # the logger is shared by the threads of every reader
+        self.lock = threading.Lock()
+        # flush policy of the csv files, see CsvLog
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        # open csv file of each station
+        self.csv_logs = {}
+        # Flush the csv files in the background when they are flushed by time
+        self.stop_event = threading.Event()
+        self.flusher = None
+        if flush_ms:
+            self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+            self.flusher.start()
+        # hts_ftp.FtpUploader of the csv files, None when they are not uploaded
+        self.uploader = uploader
+        # hts_db.ResultDatabase also keeping the results, None when there is none
+        self.database = database
+        # The MES files are written in the background
+        self.mes_writer = WriterThread(self.write_mes, name="MES writer")
+        self.mes_writer.start()
+
+    def create_directory(self):
+        """
+        Create a log directory
+        """
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        dirmes = self.mes_dir
+        if not os.path.exists(dirmes):
+            os.makedirs(dirmes)
+
+    def record_result(self, test, message):
+        """
+        Record the log for normal analysis
+        """
+        with self.lock:
+            if test not in FIELD_KEYS:
+                return
+            csv_log = self.csv_logs.get(test)
+            if csv_log is None:
+                csv_log = CsvLog(self.log_dir, test, self.line, self.flush_rows, self.flush_ms)
+                self.csv_logs[test] = csv_log
+            # one time stamp for the csv row and the MES file
+            now = datetime.datetime.now()
+            csv_log.write(message, now)
+
+            if self.uploader is not None:
+                self.uploader.upload(csv_log.file_name)
+            if self.database is not None:
+                self.database.record(self.line, test, message, now)
+            self.mes_record(test, message, now)
+
+    def flush_loop(self):
+        """
+        Background thread, flush the csv files whose rows are old enough
+        """
+        while not self.stop_event.wait(self.flush_ms/1000):
+            with self.lock:
+                for csv_log in self.csv_logs.values():
+                    csv_log.flush_due()
+
+    def close(self):
+        """
+        Write the pending MES files, flush and close the log files
+        and upload them for the last time
+        """
+        self.mes_writer.close()
+        self.stop_event.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        with self.lock:
+            for csv_log in self.csv_logs.values():
+                csv_log.close()
+                if self.uploader is not None:
+                    self.uploader.upload(csv_log.file_name)
+        if self.uploader is not None:
+            self.uploader.close(UPLOAD_CLOSE_TIMEOUT)
+        if self.database is not None:
+            self.database.close()
+
+    def mes_record(self, test, message, now):
+        """
+        Queue the log file for SUGA MES of a result at time now (datetime)
+        """
+        self.mes_writer.put((os.path.join(self.mes_dir, ''), test, message, now))
+
+    def write_mes(self, record):
+        """
+        Write the log file for SUGA MES, called in the MES writer thread
+        """
+        mes_path, test, message, now = record
+        date = now.strftime("%m/%d/%Y")
+        clock = now.strftime("%H:%M:%S")
+        mfile_name = mes_path+now.strftime("%Y%m%d%H%M%S")+'_'+message["UID"]+".txt"
+        # SUGA MES only picks up the .txt files, rename the file once it is complete
+        temp_name = mfile_name+".tmp"
+        with open(temp_name, 'w') as mes_file:
+            mes_file.write("PanelBarcode:"+message["UID"]+"\n")
+            mes_file.write("TestProgram:HELIOS_TESTING_SCRIPT\n")
+            mes_file.write("TestProgramVer:"+self.version+"\n")
+            mes_file.write("Operator:TEST\n")
+            mes_file.write("Date:"+date+"\n")
+            mes_file.write("Time:"+clock+"\n"*3)
+            mes_file.write("TestName:TEST{}".format(test)+"\n")
+            mes_file.write("Date:"+date+"\n")
+            mes_file.write("Time:"+clock+"\n")
+            if message["RES1"] and message["RES1"]%10==0:
+                mes_file.write("Result:PASS\n")
+            elif message["RES2"] and message["RES2"]%10==0:
+                mes_file.write("Result:PASS\n")
+            else:
+                mes_file.write("Result:FAIL\n")
+
+            new_message={}
+            for key,value in message.items():
+                if value is None:
+                    new_message[key] = ''
+                else:
+                    new_message[key] = "{}".format(value)+" "
+            mes_file.write("Value:"+new_message["VOLT1"]+new_message["RES1"]+new_message["DMM"]+new_message["VOLT2"]+new_message["VOLT3"]+new_message["RES2"]+"\n")
+            print("~#~", file=mes_file)
+        os.replace(temp_name, mfile_name)
@@ -0,0 +1,161 @@
+"""
+Parquet export of the HeliosLog csv files of the Helios Testing Script
+
+Converts the daily Test<n>_Line<l>_<date>.csv files into one typed Parquet
+dataset partitioned by day, product line and station:
+
+    <output>/date=2018-05-31/line=D/station=2/results.parquet
+
+Stations #1/#3 and stations #2/#4 share one schema, the columns a station does
+not write are empty. The export is incremental: a csv file is converted again
+only when it changed after its Parquet file was written, so a run converts the
+new days and the day still being tested. Needs pyarrow.
+
+    python hts_parquet.py --output C:\\PCH\\HeliosParquet C:\\PCH\\HeliosLog
+"""
+import argparse
+import operator
+import os
+import sys
+import hts_stats
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Dataset of the station, next to the directory of the csv files
+DEFAULT_OUTPUT = "C:\\PCH\\HeliosParquet"
+# Name of the Parquet file of one day, product line and station
+FILE_NAME = "results.parquet"
+# Columns of the csv files of each station
+CSV_COLUMNS = {1: ("time", "uid", "volt1", "result"),
+               2: ("time", "uid", "dmm", "volt2", "volt3", "result"),
+               3: ("time", "uid", "volt1", "result"),
+               4: ("time", "uid", "dmm", "volt2", "volt3", "result")}
+
+
+def schema():
+    """
+    Types of the columns of the Parquet files
+    """
+    return pyarrow.schema([("time", pyarrow.timestamp("us")), ("uid", pyarrow.string()),
+                           ("volt1", pyarrow.float64()), ("dmm", pyarrow.float64()),
+                           ("volt2", pyarrow.float64()), ("volt3", pyarrow.float64()),
+                           ("result", pyarrow.int16())])
+
+
+def partitioning():
+    """
+    Types of the partition keys of the directory names
+    """
+    return pyarrow.dataset.partitioning(pyarrow.schema([("date", pyarrow.string()), ("line", pyarrow.string()),
+                                                        ("station", pyarrow.int8())]), flavor="hive")
+
+
+def target_path(output, path):
+    """
+    Parquet file of a csv file, None when it is not a log file
+    """
+    parsed = hts_stats.parse_name(path)
+    if parsed is None:
+        return None
+    station, line, day = parsed
+    return os.path.join(output, "date="+day, "line="+line, "station="+str(station), FILE_NAME)
+
+
+def read_csv(path):
+    """
+    Read a csv file into a table of the Parquet schema
+    """
+    station = hts_stats.parse_name(path)[0]
+    names = CSV_COLUMNS[station]
+    types = schema()
+    table = pyarrow.csv.read_csv(
+        path,
+        read_options=pyarrow.csv.ReadOptions(column_names=names),
+        convert_options=pyarrow.csv.ConvertOptions(column_types={name: types.field(name).type for name in names}))
+    columns = []
+    for field in types:
+        if field.name in names:
+            columns.append(table.column(field.name))
+        else:
+            columns.append(pyarrow.nulls(table.num_rows, field.type))
+    return pyarrow.Table.from_arrays(columns, schema=types)
+
+
+def export_file(path, target):
+    """
+    Convert a csv file to its Parquet file, written under a temporary name first
+    """
+    directory = os.path.dirname(target)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    table = read_csv(path)
+    temp_name = target + ".tmp"
+    pyarrow.parquet.write_table(table, temp_name, compression="zstd")
+    os.replace(temp_name, target)
+    return table.num_rows
+
+
+def export(paths, output=DEFAULT_OUTPUT, since=None, until=None):
+    """
+    Convert the csv files of the paths (directories, files or patterns) which
+    changed since their last export, return the numbers of files converted and
+    skipped and of rows converted
+    """
+    converted = skipped = rows = 0
+    for path in hts_stats.find_logs(paths, since, until):
+        target = target_path(output, path)
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            skipped += 1
+            continue
+        try:
+            rows += export_file(path, target)
+            converted += 1
+        except pyarrow.ArrowInvalid as error:
+            print(path, error)
+    return converted, skipped, rows
+
+
+def load(output=DEFAULT_OUTPUT, since=None, until=None, line=None, station=None, columns=None):
+    """
+    Read the results between the days since and until (like "2018-05-31"), of
+    a product line and station when given, into one pyarrow Table
+    """
+    dataset = pyarrow.dataset.dataset(output, format="parquet", partitioning=partitioning())
+    condition = None
+    for key, compare, value in (("date", operator.ge, since), ("date", operator.le, until),
+                                ("line", operator.eq, line), ("station", operator.eq, station)):
+        if value is None:
+            continue
+        term = compare(pyarrow.dataset.field(key), value)
+        condition = term if condition is None else condition & term
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=["C:\\PCH\\HeliosLog"], help="log directories, files or patterns")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="directory of the Parquet dataset")
+    parser.add_argument("--since", help="first day, like 2018-01-01")
+    parser.add_argument("--until", help="last day, like 2018-12-31")
+    args = parser.parse_args(argv)
+
+    if pyarrow is None:
+        print("the Parquet export needs pyarrow")
+        return 1
+    converted, skipped, rows = export(args.paths, args.output, args.since, args.until)
+    print("{} files converted ({} rows), {} files up to date".format(converted, rows, skipped))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
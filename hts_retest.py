@@ -0,0 +1,139 @@
+"""
+Retest index of the Helios Testing Script
+
+Remembers how many times every UID was tested today at each station and its
+last result, so a sensor put on the reader again after a REDO or a fail is
+flagged as soon as its UID is read. The index is built from the daily csv
+files of the product line when the script starts and updated with every
+result. It is cleared after midnight, like the csv files start over. The 64-bit UIDs are kept as ints, which is smaller and faster to hash
+than the hex text.
+"""
+import datetime
+import os
+import threading
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+def uid_key(uid):
+    """
+    Key of a UID in the index, the int of its hex text
+    """
+    try:
+        return int(uid, 16)
+    except (TypeError, ValueError):
+        return uid
+
+
+def result_code(test, message):
+    """
+    Result code of a result message of a station
+    """
+    if test == 1 or test == 3:
+        return message["RES1"]
+    return message["RES2"]
+
+
+def retest_text(tests, code):
+    """
+    Text shown for a UID tested tests times before with the last result code
+    """
+    if code is None or code % 10 == 0:
+        return "retest #{}, previously passed".format(tests + 1)
+    if code == 99:
+        return "retest #{}, previously REDO".format(tests + 1)
+    return "retest #{}, previously failed {}".format(tests + 1, code)
+
+
+class RetestIndex(object):
+    """
+    Number of tests and last result code of every UID, by station
+    """
+    def __init__(self):
+        # {station: {UID key: (tests, last result code)}}
+        self.stations = {1: {}, 2: {}, 3: {}, 4: {}}
+        # day of the results in the index
+        self.date = datetime.date.today()
+        # the serial threads of every reader share the index
+        self.lock = threading.Lock()
+
+    def new_day(self):
+        """
+        Clear the index when the day changed since its results, the csv
+        files of the new day hold no result which is not added afterwards
+        """
+        today = datetime.date.today()
+        if today == self.date:
+            return
+        with self.lock:
+            if today != self.date:
+                for uids in self.stations.values():
+                    uids.clear()
+                self.date = today
+
+    def load(self, log_dir, line, date=None):
+        """
+        Add the results of the csv files of a day (today by default) of the product line,
+        return the number of results
+        """
+        if date is None:
+            date = datetime.date.today()
+        with self.lock:
+            self.date = date
+        count = 0
+        for test, uids in self.stations.items():
+            file_name = os.path.join(log_dir, "Test"+str(test)+"_Line"+line+'_'+str(date)+".csv")
+            try:
+                with open(file_name, 'r', newline='') as log_file:
+                    rows = log_file.read().splitlines()
+            except OSError:
+                continue
+            with self.lock:
+                for row in rows:
+                    # time,UID,...,result code, the values hold no comma
+                    fields = row.split(",")
+                    if len(fields) < 4:
+                        continue
+                    try:
+                        code = int(fields[-1])
+                    except ValueError:
+                        code = None
+                    key = uid_key(fields[1])
+                    tests = uids.get(key, (0, None))[0]
+                    uids[key] = (tests + 1, code)
+                    count += 1
+        return count
+
+    def lookup(self, test, uid):
+        """
+        Number of tests and last result code of a UID at a station, None when it was not tested
+        """
+        self.new_day()
+        uids = self.stations.get(test)
+        if uids is None:
+            return None
+        return uids.get(uid_key(uid))
+
+    def add(self, test, uid, code):
+        """
+        Count a result of a UID at a station
+        """
+        self.new_day()
+        uids = self.stations.get(test)
+        if uids is None:
+            return
+        key = uid_key(uid)
+        with self.lock:
+            tests = uids.get(key, (0, None))[0]
+            uids[key] = (tests + 1, code)
+
+    def text(self, test, uid):
+        """
+        Text shown for a UID put on the reader of a station, empty for its first test
+        """
+        found = self.lookup(test, uid)
+        if found is None:
+            return ''
+        return retest_text(*found)
@@ -0,0 +1,370 @@
+"""
+Serial port acquisition modes for the Helios Testing Script
+
+The default mode in HTS.SerialThread polls readline() with a 100ms timeout and
+counts the empty readings to find out when the sensor is taken away. The
+asyncio mode here waits for the lines instead: a helper thread blocks in the
+port read and hands the data to an event loop, which feeds every complete line
+to the engine at once and treats the removal of the sensor as a deadline.
+
+The chunk mode keeps the 100ms timeout, but reads everything the port holds at
+once instead of one byte at a time as readline() does, and frames the lines in
+place in a reusable buffer.
+
+In every mode the port can be wrapped in a RecordingPort, which keeps the raw
+bytes received with their time in a RawRing of fixed size. The ring is written
+as a capture file when something goes wrong, and the file replays through the
+engine like any other capture.
+"""
+import array
+import asyncio
+import threading
+import time
+import hts_capture
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Most timeout records written for a quiet period of the reader
+MAX_TIMEOUTS = 100
+# Longest time (s) the asyncio mode waits for a line before it reads the
+# station and settings queues
+QUEUE_POLL = 0.2
+# Reads of the port within this time (s) of the first one are kept as one chunk
+MERGE_TIME = 0.005
+
+
+class RawRing(object):
+    """
+    Ring buffer of the last bytes received from a reader with their time.time()
+    receive time, allocated once: the oldest bytes and chunks are overwritten.
+    The reads of one byte at a time are merged into chunks of MERGE_TIME
+    """
+    def __init__(self, size=576000, chunks=None):
+        # received bytes, the byte number n is at n % size
+        self.data = bytearray(size)
+        # receive time of the last read, number of the first byte and length of
+        # every chunk, the chunk number n is at n % chunks
+        if chunks is None:
+            # A chunk starts at most every MERGE_TIME, so the chunks last as long
+            # as the bytes received at the full baud rate
+            chunks = max(16, int(size / (hts_capture.BAUD/10 * MERGE_TIME)))
+        self.times = array.array('d', bytes(8*chunks))
+        self.starts = array.array('q', bytes(8*chunks))
+        self.lengths = array.array('l', bytes(array.array('l').itemsize*chunks))
+        # number of bytes and chunks received since the start
+        self.total = 0
+        self.count = 0
+        # receive time of the first read of the last chunk
+        self.first = None
+        self.lock = threading.Lock()
+
+    def add(self, data, when=None):
+        """
+        Keep the bytes of one read of the port
+        """
+        length = len(data)
+        if not length:
+            return
+        if when is None:
+            when = time.time()
+        size = len(self.data)
+        if length > size:
+            data = data[length-size:]
+            length = size
+        with self.lock:
+            position = self.total % size
+            first = min(length, size - position)
+            self.data[position:position+first] = data[:first]
+            if first < length:
+                self.data[:length-first] = data[first:]
+            slot = (self.count - 1) % len(self.times)
+            if self.count and when - self.first < MERGE_TIME and self.lengths[slot] + length <= size:
+                # the read follows the last one closely, it ends the last chunk
+                self.times[slot] = when
+                self.lengths[slot] += length
+            else:
+                slot = self.count % len(self.times)
+                self.times[slot] = when
+                self.starts[slot] = self.total
+                self.lengths[slot] = length
+                self.count += 1
+                self.first = when
+            self.total += length
+
+    def chunks(self):
+        """
+        The chunks still held, the oldest first, as (time, bytes)
+        """
+        size = len(self.data)
+        with self.lock:
+            chunks = []
+            oldest = self.total - size
+            for number in range(max(0, self.count - len(self.times)), self.count):
+                slot = number % len(self.times)
+                start = self.starts[slot]
+                if start < oldest:
+                    continue
+                position = start % size
+                end = position + self.lengths[slot]
+                if end <= size:
+                    chunk = bytes(self.data[position:end])
+                else:
+                    chunk = bytes(self.data[position:]) + bytes(self.data[:end-size])
+                chunks.append((self.times[slot], chunk))
+        return chunks
+
+    def records(self, until=None):
+        """
+        The received lines as capture records (time, line), timed by the chunk
+        ending them, with an empty record for every readline timeout the
+        polling mode would have had between two lines and until the time until,
+        MAX_TIMEOUTS at most for a quiet period
+        """
+        records = []
+        rest = b""
+        last = None
+        for when, chunk in self.chunks() + [(until, None)]:
+            if when is None:
+                break
+            if last is not None:
+                # the timeouts while the reader was quiet
+                count = min(int((when - last) / hts_capture.TIMEOUT), MAX_TIMEOUTS)
+                for number in range(1, count + 1):
+                    records.append((last + number*hts_capture.TIMEOUT, b""))
+            if chunk is None:
+                break
+            last = when
+            lines = (rest + chunk).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                records.append((when, line.rstrip(b"\r")))
+        if rest:
+            records.append((last, rest.rstrip(b"\r")))
+        return records
+
+    def dump(self, path):
+        """
+        Write the received lines up to now as a capture file, return the number of records
+        """
+        records = self.records(time.time())
+        hts_capture.write_capture(path, records)
+        return len(records)
+
+
+class RecordingPort(object):
+    """
+    Serial port wrapper keeping every byte read in a RawRing
+    """
+    def __init__(self, ser, ring):
+        self.ser = ser
+        self.ring = ring
+
+    def readline(self):
+        line = self.ser.readline()
+        self.ring.add(line)
+        return line
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self.ring.add(data)
+        return data
+
+    def readinto(self, buffer):
+        count = self.ser.readinto(buffer)
+        if count:
+            self.ring.add(buffer[:count])
+        return count
+
+    @property
+    def timeout(self):
+        return self.ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.ser.timeout = value
+
+    def __getattr__(self, name):
+        # in_waiting, cancel_read, close and the rest of the port
+        return getattr(self.ser, name)
+
+
+class AsyncLineReader(object):
+    """
+    Deliver the lines read from a serial port to an asyncio queue
+    """
+    def __init__(self, ser, loop):
+        self.ser = ser
+        self.loop = loop
+        # complete lines, including the line ending, or the error which
+        # stopped the helper thread
+        self.lines = asyncio.Queue()
+        # bytes received after the last line ending
+        self.buffer = bytearray()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.read_port, daemon=True)
+
+    def start(self):
+        """
+        Start the helper thread, the port read blocks until data arrives
+        """
+        self.ser.timeout = None
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the helper thread and wake it up from the port read
+        """
+        self.stopped = True
+        self.ser.cancel_read()
+        self.thread.join()
+
+    def read_port(self):
+        """
+        Helper thread, read whatever the port holds and pass it to the loop
+        """
+        while not self.stopped:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except Exception as error:
+                # The reader is gone, like an unplugged USB reader: acquire() raises the error
+                if not self.stopped:
+                    self.loop.call_soon_threadsafe(self.lines.put_nowait, error)
+                return
+            if data:
+                self.loop.call_soon_threadsafe(self.data_received, data)
+
+    def data_received(self, data):
+        """
+        Split the received data into lines, called in the event loop
+        """
+        self.buffer += data
+        end = self.buffer.find(b"\n")
+        while end >= 0:
+            self.lines.put_nowait(bytes(self.buffer[:end+1]))
+            del self.buffer[:end+1]
+            end = self.buffer.find(b"\n")
+
+
+class ChunkReader(object):
+    """
+    Read the serial port in chunks into a reusable buffer
+    and frame the lines as memoryview slices of it
+    """
+    def __init__(self, ser, size=4096):
+        self.ser = ser
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # incomplete line left in the buffer by the last read
+        self.start = 0
+        self.end = 0
+
+    def read_frames(self):
+        """
+        Read the port once and return the complete lines (with line ending)
+        as memoryview slices, valid until the next call, an empty list when
+        only a part of a line was read and None when the read timed out
+        """
+        # Move the incomplete line to the front of the buffer
+        rest = self.end - self.start
+        if rest and self.start:
+            self.buffer[:rest] = bytes(self.view[self.start:self.end])
+        self.start = 0
+        self.end = rest
+
+        # Wait for the first byte, then take everything the port holds
+        size = len(self.buffer)
+        want = min(size - self.end, max(1, self.ser.in_waiting))
+        count = self.ser.readinto(self.view[self.end:self.end+want])
+        if not count:
+            return None
+        self.end += count
+
+        frames = []
+        find = self.buffer.find
+        start = 0
+        stop = find(b"\n", self.end - count, self.end)
+        while stop >= 0:
+            frames.append(self.view[start:stop+1])
+            start = stop + 1
+            stop = find(b"\n", start, self.end)
+        # A full buffer without line ending is passed on as it is
+        if start == 0 and self.end == size:
+            frames.append(self.view[:size])
+            start = size
+        self.start = start
+        return frames
+
+
+async def acquire(ser, engine, handle, station_queue=None, settings_queue=None):
+    """
+    Feed the lines of the serial port to the engine until cancelled,
+    handle is called with every event of the engine, the error of a failed
+    port read is raised
+    """
+    loop = asyncio.get_event_loop()
+    reader = AsyncLineReader(ser, loop)
+    reader.start()
+    deadline = None
+
+    def judge_dmm():
+        # Judge station #2 as soon as its DMM reading is there, in the loop
+        if engine.dmm_waiting:
+            events = []
+            engine.check_dmm(events)
+            for event in events:
+                handle(event)
+
+    def dmm_arrived():
+        # Called from the DMM service thread
+        try:
+            loop.call_soon_threadsafe(judge_dmm)
+        except RuntimeError:
+            # the loop is closed
+            pass
+
+    if engine.dmm is not None:
+        engine.dmm.listener = dmm_arrived
+    try:
+        while True:
+            # Read the station selection queue
+            if station_queue is not None and station_queue.full():
+                engine.test = station_queue.get()
+            # Read the settings queue
+            if settings_queue is not None and settings_queue.full():
+                engine.configure(settings_queue.get())
+
+            if not reader.lines.empty():
+                line = reader.lines.get_nowait()
+            else:
+                # Stop waiting every QUEUE_POLL to take the queues of a quiet reader
+                wait = QUEUE_POLL if deadline is None else min(QUEUE_POLL, max(0, deadline - loop.time()))
+                try:
+                    line = await asyncio.wait_for(reader.lines.get(), wait)
+                except asyncio.TimeoutError:
+                    # The DMM reading may not come any more
+                    judge_dmm()
+                    if deadline is not None and loop.time() >= deadline:
+                        deadline = None
+                        for event in engine.sensor_removed():
+                            handle(event)
+                    continue
+            if isinstance(line, Exception):
+                raise line
+
+            engine.sensor_seen = False
+            for event in engine.feed(line):
+                handle(event)
+            # Restart the removal deadline when the sensor is still on the board
+            if engine.sensor_seen:
+                # The sensor is taken away when no ADC value arrives for as long as
+                # the polling mode needs to count sensor_out_max+1 empty readings
+                deadline = loop.time() + (engine.sensor_out_max + 1) * hts_capture.TIMEOUT
+            elif not engine.head:
+                deadline = None
+    finally:
+        if engine.dmm is not None:
+            engine.dmm.listener = None
+        reader.stop()
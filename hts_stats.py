@@ -0,0 +1,290 @@
+"""
+Analysis of the HeliosLog csv files of the Helios Testing Script
+
+Reads the daily Test<n>_Line<l>_<date>.csv files written by hts_log.ResultLogger,
+one file at a time in each worker process, and prints the yield by product
+line, station and day, the Pareto of the error codes and the distribution of
+the voltages. A file is reduced to the counts of its result codes and of its
+voltages, which are small and merged in the main process:
+
+    python hts_stats.py C:\\PCH\\HeliosLog
+    python hts_stats.py --by line,station --since 2018-01-01 logs\\*.csv
+"""
+import argparse
+import collections
+import glob
+import itertools
+import multiprocessing
+import operator
+import os
+import re
+import sys
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Log file name, like Test2_LineD_2018-05-31.csv
+FILE_NAME = re.compile(r"Test(\d)_Line(\w+?)_(\d{4}-\d{2}-\d{2})\.csv$")
+# Columns after the time and the UID, by station
+COLUMNS = {1: ("volt1",),
+           2: ("dmm", "volt2", "volt3"),
+           3: ("volt1",),
+           4: ("dmm", "volt2", "volt3")}
+# Grouping keys of the yield table
+KEYS = ("line", "station", "day")
+# DMM column of a part without a DMM reading (hts_dmm.NO_READING)
+NO_READING = -1.0
+# Rows of a log file counted at a time
+BLOCK_ROWS = 65536
+
+
+def parse_name(path):
+    """
+    Station, product line and day of a log file, None when it is not a log file
+    """
+    match = FILE_NAME.search(os.path.basename(path))
+    if not match or int(match.group(1)) not in COLUMNS:
+        return None
+    return int(match.group(1)), match.group(2), match.group(3)
+
+
+class Summary(object):
+    """
+    Counts of the result codes and of the voltages of a group of tests,
+    summaries of several files are merged
+    """
+    def __init__(self):
+        # number of tests by result code
+        self.codes = collections.Counter()
+        # number of readings by voltage (mV), by column
+        self.voltages = collections.defaultdict(collections.Counter)
+        # rows and values which could not be read
+        self.errors = 0
+
+    @property
+    def tests(self):
+        return sum(self.codes.values())
+
+    @property
+    def passed(self):
+        return sum(count for code, count in self.codes.items() if code % 10 == 0)
+
+    def merge(self, other):
+        """
+        Add the counts of another summary
+        """
+        self.codes.update(other.codes)
+        for column, voltages in other.voltages.items():
+            self.voltages[column].update(voltages)
+        self.errors += other.errors
+
+    def voltage_stats(self, column):
+        """
+        Count, mean, standard deviation, minimum, 5th percentile, median,
+        95th percentile and maximum of a column, None when it is empty
+        """
+        voltages = self.voltages.get(column)
+        if not voltages:
+            return None
+        count = sum(voltages.values())
+        mean = sum(voltage*number for voltage, number in voltages.items()) / count
+        stdev = (sum((voltage - mean)**2 * number for voltage, number in voltages.items()) / count) ** 0.5
+        ordered = sorted(voltages)
+        percentiles = []
+        for fraction in (0.05, 0.5, 0.95):
+            rank = int(fraction * (count - 1))
+            seen = 0
+            for voltage in ordered:
+                seen += voltages[voltage]
+                if seen > rank:
+                    percentiles.append(voltage)
+                    break
+        return (count, mean, stdev, ordered[0]) + tuple(percentiles) + (ordered[-1],)
+
+
+def to_numbers(texts, convert, summary):
+    """
+    Convert the counts by text of a file to counts by number,
+    the texts which are not numbers are counted as errors
+    """
+    numbers = collections.Counter()
+    for text, count in texts.items():
+        try:
+            numbers[convert(text)] += count
+        except ValueError:
+            summary.errors += count
+    return numbers
+
+
+def read_log(path):
+    """
+    Summarize one log file, return its station, line, day and Summary
+    """
+    station, line, day = parse_name(path)
+    columns = COLUMNS[station]
+    width = 3 + len(columns)
+    errors = 0
+    codes = collections.Counter()
+    texts = [collections.Counter() for column in columns]
+    with open(path, 'r', newline='') as log_file:
+        # The file is streamed a block of rows at a time, the rows of a block
+        # only count their texts, which are converted once per distinct value
+        while True:
+            block = list(itertools.islice(log_file, BLOCK_ROWS))
+            if not block:
+                break
+            # The values hold no comma or quote, a plain split is enough
+            rows = [row.split(",") for row in map(str.rstrip, block) if row]
+            good = [fields for fields in rows if len(fields) == width]
+            errors += len(rows) - len(good)
+            codes.update(map(operator.itemgetter(-1), good))
+            for number, counter in enumerate(texts):
+                counter.update(map(operator.itemgetter(2 + number), good))
+    summary = Summary()
+    summary.errors = errors
+    summary.codes = to_numbers(codes, int, summary)
+    for column, counter in zip(columns, texts):
+        counter.pop("", None)
+        voltages = to_numbers(counter, float, summary)
+        if column == "dmm":
+            voltages.pop(NO_READING, None)
+        summary.voltages[column] = voltages
+    return station, line, day, summary
+
+
+def grouping(text):
+    """
+    Grouping keys of the yield table from a comma-separated list, like "line,station"
+    """
+    keys = tuple(key.strip() for key in text.split(",") if key.strip())
+    for key in keys:
+        if key not in KEYS:
+            raise argparse.ArgumentTypeError("invalid key {!r} (choose from {})".format(key, ", ".join(KEYS)))
+    if not keys:
+        raise argparse.ArgumentTypeError("no grouping key")
+    return keys
+
+
+def find_logs(paths, since=None, until=None):
+    """
+    The log files of the paths (directories, files or patterns), between the days since and until
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            names = glob.glob(path)
+        for name in names:
+            parsed = parse_name(name)
+            if parsed is None or not os.path.isfile(name):
+                continue
+            day = parsed[2]
+            if (since and day < since) or (until and day > until):
+                continue
+            files.append(name)
+    return sorted(files)
+
+
+def summarize(files, by=KEYS, jobs=None):
+    """
+    Read the log files in parallel, return the Summary of every group
+    of the keys by and the Summary of all the files by station
+    """
+    groups = collections.defaultdict(Summary)
+    stations = collections.defaultdict(Summary)
+    if jobs == 1 or len(files) < 2:
+        results = map(read_log, files)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(read_log, files, chunksize=max(1, len(files) // (8 * (jobs or os.cpu_count() or 1))))
+    try:
+        for station, line, day, summary in results:
+            values = {"line": line, "station": station, "day": day}
+            groups[tuple(values[key] for key in by)].merge(summary)
+            stations[station].merge(summary)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return groups, stations
+
+
+def print_yield(groups, by):
+    """
+    Print the yield table
+    """
+    print(" ".join("{:<10}".format(key) for key in by) + "   tests    pass   yield  top failures")
+    for key in sorted(groups, key=lambda key: tuple(str(value) for value in key)):
+        summary = groups[key]
+        tests = summary.tests
+        failures = [(code, count) for code, count in summary.codes.most_common() if code % 10][:3]
+        print(" ".join("{:<10}".format(value) for value in key) + " {:7d} {:7d} {:6.2f}%  {}".format(
+            tests, summary.passed, 100.0 * summary.passed / tests if tests else 0,
+            "  ".join("{}:{}".format(code, count) for code, count in failures)))
+
+
+def print_pareto(stations):
+    """
+    Print the error codes from the most frequent one, with the cumulative share
+    """
+    codes = collections.Counter()
+    for summary in stations.values():
+        codes.update(summary.codes)
+    failures = [(code, count) for code, count in codes.most_common() if code % 10]
+    total = sum(count for _, count in failures)
+    print("error code   count   share  cumulative")
+    cumulative = 0
+    for code, count in failures:
+        cumulative += count
+        print("{:>10} {:7d} {:6.2f}%  {:6.2f}%".format(code, count, 100.0*count/total, 100.0*cumulative/total))
+
+
+def print_voltages(stations):
+    """
+    Print the distribution of the voltages of every station
+    """
+    print("station column   count     mean   stdev      min      p5     p50     p95      max   (mV)")
+    for station in sorted(stations):
+        summary = stations[station]
+        for column in COLUMNS[station]:
+            stats = summary.voltage_stats(column)
+            if stats is None:
+                continue
+            print("{:>7} {:<6} {:7d} {:8.3f} {:7.3f} {:8.3f} {:7.2f} {:7.2f} {:7.2f} {:8.3f}".format(
+                station, column, *stats))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", default=["C:\\PCH\\HeliosLog"],
+                        help="log directories, files or patterns")
+    parser.add_argument("--by", type=grouping, default=KEYS,
+                        help="grouping of the yield table, comma-separated keys of " + ",".join(KEYS))
+    parser.add_argument("--since", help="first day, like 2018-01-01")
+    parser.add_argument("--until", help="last day, like 2018-12-31")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes, all the cores by default")
+    args = parser.parse_args(argv)
+
+    files = find_logs(args.paths, args.since, args.until)
+    if not files:
+        print("no log files")
+        return 1
+    groups, stations = summarize(files, args.by, args.jobs)
+    errors = sum(summary.errors for summary in stations.values())
+    print("{} log files, {} tests{}".format(len(files), sum(summary.tests for summary in stations.values()),
+                                            ", {} unreadable rows".format(errors) if errors else ""))
+    print()
+    print_yield(groups, args.by)
+    print()
+    print_pareto(stations)
+    print()
+    print_voltages(stations)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
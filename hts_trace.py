@@ -0,0 +1,164 @@
+"""
+Raw ADC trace capture of the Helios Testing Script
+
+Keeps every ADC word the engine reads for a part, not only the ones which are
+averaged or judged. The traces are appended by a background thread to a daily
+binary file next to the csv files, Trace_Line<l>_<date>.bin. Each part is a
+36-byte header followed by its words as little-endian uint16:
+
+    magic "HTR1", station (uint8), product line (1 character), 2 unused bytes,
+    UID (uint64), time of the UID and of the removal (float64, time.time()),
+    number of words (uint32)
+
+The file can be memory-mapped: read_traces() walks the headers and returns the
+words of every part without copying them, as NumPy arrays when NumPy is
+installed, for reprocessing with hts_adc.
+
+    python hts_trace.py C:\\PCH\\HeliosLog\\Trace_LineD_2018-05-31.bin
+"""
+import argparse
+import array
+import collections
+import datetime
+import mmap
+import os
+import struct
+import sys
+import hts_adc
+import hts_log
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+MAGIC = b"HTR1"
+HEADER = struct.Struct("<4sBc2xQddI")
+
+# One part read back from a trace file, words is a view into the file
+TraceRecord = collections.namedtuple("TraceRecord", ["uid", "test", "line", "start", "stop", "words"])
+
+
+def uid_number(uid):
+    """
+    The UID as an uint64, 0 when it is not a hex number
+    """
+    try:
+        return int(uid, 16) & 0xFFFFFFFFFFFFFFFF
+    except (TypeError, ValueError):
+        return 0
+
+
+def pack(trace, line):
+    """
+    Bytes of a hts_engine.Trace in the trace file
+    """
+    words = trace.words
+    if sys.byteorder != "little":
+        words = array.array('H', words)
+        words.byteswap()
+    return HEADER.pack(MAGIC, trace.test, line[:1].encode("latin1"), uid_number(trace.uid),
+                       trace.start, trace.stop, len(words)) + words.tobytes()
+
+
+class TraceLog(object):
+    """
+    Daily binary file of the ADC traces of a product line, written by a
+    background thread so the serial threads only queue the traces
+    """
+    def __init__(self, log_dir, line):
+        self.log_dir = log_dir
+        self.line = line
+        self.file = None
+        self.date = None
+        self.file_name = None
+        self.writer = hts_log.WriterThread(self.write, name="Trace writer")
+        self.writer.start()
+
+    def record(self, trace):
+        """
+        Queue the hts_engine.Trace of a part
+        """
+        self.writer.put(trace)
+
+    def write(self, trace):
+        """
+        Append a trace to the file of its day, called in the writer thread
+        """
+        date = datetime.date.fromtimestamp(trace.start)
+        if date != self.date:
+            self.close_file()
+            self.date = date
+            self.file_name = os.path.join(self.log_dir, "Trace_Line"+self.line+'_'+str(date)+".bin")
+            self.file = open(self.file_name, 'ab')
+        self.file.write(pack(trace, self.line))
+        # a burst of traces is flushed once
+        if self.writer.queue.empty():
+            self.file.flush()
+
+    def close_file(self):
+        """
+        Close the file of the day
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        """
+        Write the queued traces and close the file
+        """
+        self.writer.close()
+        self.close_file()
+
+
+def read_traces(path):
+    """
+    Every part of a trace file, a truncated last part is left out
+    """
+    with open(path, 'rb') as trace_file:
+        if os.fstat(trace_file.fileno()).st_size == 0:
+            return []
+        data = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+    records = []
+    offset = 0
+    size = len(data)
+    while offset + HEADER.size <= size:
+        magic, test, line, uid, start, stop, count = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError("{}: no trace at byte {}".format(path, offset))
+        offset += HEADER.size
+        if offset + 2*count > size:
+            break
+        if hts_adc.numpy is not None:
+            words = hts_adc.numpy.frombuffer(data, dtype="<u2", count=count, offset=offset)
+        else:
+            words = memoryview(data)[offset: offset + 2*count].cast('H')
+        records.append(TraceRecord("{:016X}".format(uid), test, line.decode("latin1"), start, stop, words))
+        offset += 2*count
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="trace files")
+    parser.add_argument("--start", type=int, default=10, help="first word averaged at station #1 and station #3")
+    parser.add_argument("--stop", type=int, default=20, help="word after the last one averaged")
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        records = read_traces(path)
+        print("{}: {} parts, {} words".format(path, len(records), sum(len(record.words) for record in records)))
+        # The averages of station #1 and station #3 computed again from the words
+        for test in (1, 3):
+            rows = [record.words[:args.stop] for record in records
+                    if record.test == test and len(record.words) >= args.stop]
+            if rows:
+                averages = hts_adc.window_averages(rows, args.start, args.stop)
+                print("  station {}: {} averages, mean {:.3f} mV, max {:.3f} mV".format(
+                    test, len(averages), sum(averages)/len(averages), max(averages)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
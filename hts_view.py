@@ -0,0 +1,119 @@
+"""
+View model of the result panel of the Helios Testing Script
+
+Turns a message of the reader into the text and colour of every widget of a
+result panel, and remembers what was rendered last so the panel only touches
+the Tk widgets whose value really changed. It does not import tkinter.
+"""
+
+__author__ = "Justin Fu"
+__copyright__ = "Copyright 2018, Helios Testing Script"
+__email__ = "justin.fu@pchintl.com"
+
+
+# Widgets of a result panel
+UID = "uid"
+AVG = "avg"
+DMM = "dmm"
+CHARGE = "charge"
+DISCHARGE = "discharge"
+RESULT_AVG = "result_avg"
+RESULT_CD = "result_cd"
+RETEST = "retest"
+
+# Marks a widget which is not rendered yet
+UNKNOWN = object()
+
+
+def box_text(value):
+    """
+    Text of a value box, empty when there is no value
+    """
+    if value is None:
+        return ''
+    return str(value)
+
+
+def result_avg(res):
+    """
+    Text and colour of the PASS/FAIL box of station #1 and station #3,
+    colour None is the original colour of the box
+    """
+    if res is None:
+        # reset
+        return '', None
+    elif res % 10:
+        # fail
+        return str(res), "red"
+    else:
+        # pass
+        return "PASS", "green"
+
+
+def result_cd(res):
+    """
+    Text and colour of the PASS/FAIL box of station #2 and station #4,
+    colour None is the original colour of the box
+    """
+    if res is None:
+        # reset
+        return '', None
+    elif res == 99:
+        # redo
+        return "REDO", "yellow"
+    elif res % 10:
+        # fail
+        return str(res), "red"
+    else:
+        # pass
+        return "PASS", "green"
+
+
+def retest(text):
+    """
+    Text and colour of the retest flag beside the UID,
+    colour None is the original colour of the label
+    """
+    if not text:
+        return '', None
+    return text, "orange"
+
+
+def render(message):
+    """
+    The value of every widget of a result panel for a message
+    """
+    return {UID: box_text(message["UID"]),
+            AVG: box_text(message["VOLT1"]),
+            DMM: box_text(message["DMM"]),
+            CHARGE: box_text(message["VOLT2"]),
+            DISCHARGE: box_text(message["VOLT3"]),
+            RESULT_AVG: result_avg(message["RES1"]),
+            RESULT_CD: result_cd(message["RES2"]),
+            RETEST: retest(message.get("RETEST"))}
+
+
+class PanelView(object):
+    """
+    The last rendered value of every widget of a result panel
+    """
+    def __init__(self):
+        self.shown = {}
+
+    def changes(self, message):
+        """
+        Return the widgets whose value differs from the last rendering,
+        the new values are taken as rendered
+        """
+        changed = {}
+        for name, value in render(message).items():
+            if self.shown.get(name, UNKNOWN) != value:
+                changed[name] = value
+                self.shown[name] = value
+        return changed
+
+    def set(self, name, value):
+        """
+        Take a value rendered outside of a message as the value of a widget
+        """
+        self.shown[name] = value